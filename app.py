@@ -1,17 +1,22 @@
 # app.py — robusto (retry + cache) + separação por marca (5 links)
-import re, calendar, time, random
+import os, calendar, hashlib, threading, time
+from dataclasses import dataclass, replace
 from datetime import datetime, date
+from pathlib import Path
 
 import streamlit as st
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import altair as alt
 
-import gspread
-from gspread.exceptions import APIError
-from oauth2client.service_account import ServiceAccountCredentials
-# (se quiser migrar depois: from google.oauth2.service_account import Credentials)
+import engine
+from engine import (BrandPartition, DataSnapshot, IngestError, CONSOLIDADO, CATCHUP_COLS, HEAT_DOW, HEAT_PCT,
+                    MONTH_QUERY, _sheet_id, _ym_token, ym_int, is_workday, rows_periodo, normalize_month_frame,
+                    meta_marca_mes, metas_marcas_mes, metas_unidades_df)
+from sources import FileSheetsSource, GoogleSheetsSource, LocalSheetsSource
+from perf import METRICS, RunTimer, enable_log
+
+PERF = RunTimer()  # tempo por seção deste rerun (ver painel no fim do script)
 
 # ================= CONFIG BÁSICA =================
 st.set_page_config(layout="wide", page_title="Acompanhamento de Meta Mensal - Vistorias")
@@ -36,212 +41,380 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ================= CONEXÃO GOOGLE SHEETS (com retry + cache) =================
-SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-
-def _should_retry(exc: Exception) -> bool:
-    msg = str(exc).lower()
-    return any(s in msg for s in [
-        "rate limit", "quota", "429", "internal error", "backend error",
-        "failed to fetch", "fetch_sheet_metadata", "service unavailable", "deadline"
-    ])
-
-def _with_retry(fn, *, tries=5, base=0.8, jitter=0.3):
-    last = None
-    for i in range(tries):
-        try:
-            return fn()
-        except APIError as e:
-            last = e
-            if i == tries - 1 or not _should_retry(e):
-                raise
-            time.sleep(base * (2 ** i) + random.random() * jitter)
-        except Exception as e:
-            last = e
-            if i == tries - 1 or not _should_retry(e):
-                raise
-            time.sleep(base * (2 ** i) + random.random() * jitter)
-    if last:
-        raise last
-
 @st.cache_resource(show_spinner=False)
 def _get_client():
-    creds_dict = st.secrets["gcp_service_account"]
-    # oauth2client (como já usa hoje):
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
-    # Se migrar futuramente:
-    # creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPE)
-    return gspread.authorize(creds)
+    return engine.authorize(st.secrets["gcp_service_account"])
+
+# Fonte dos dados: "gsheets" (padrão), "files" (.xlsx/.csv/Parquet exportados, caminhos relativos a
+# FILES_DIR; INDEX_SHEET_ID e as URLs de ARQUIVOS viram caminhos) ou "local" (CSVs em
+# LOCAL_SHEETS_DIR, p/ testes e benchmark)
+DATA_SOURCE = str(st.secrets.get("DATA_SOURCE", "gsheets")).strip().lower()
+
+@st.cache_resource(show_spinner=False)
+def _get_source():
+    if DATA_SOURCE == "files":
+        return FileSheetsSource(st.secrets.get("FILES_DIR", "."))
+    if DATA_SOURCE == "local":
+        return LocalSheetsSource(
+            st.secrets.get("LOCAL_SHEETS_DIR", "fixtures"),
+            latency=float(st.secrets.get("LOCAL_LATENCY", 0)),
+            jitter=float(st.secrets.get("LOCAL_JITTER", 0)),
+            rate_limit_prob=float(st.secrets.get("LOCAL_RATE_LIMIT_PROB", 0)),
+            error_prob=float(st.secrets.get("LOCAL_ERROR_PROB", 0)),
+            retry_base=float(st.secrets.get("RETRY_BASE", 0.8)),
+            quota_per_min=float(st.secrets.get("LOCAL_QUOTA_PER_MIN", 0)),
+            quota_cooldown=float(st.secrets.get("QUOTA_COOLDOWN", 1)),
+        )
+    # limitador e circuito vivem na fonte (cache_resource): valem para o processo inteiro
+    return GoogleSheetsSource(_get_client, retry_base=float(st.secrets.get("RETRY_BASE", 0.8)),
+                              quota_per_min=float(st.secrets.get("SHEETS_QUOTA_PER_MIN", 60)),
+                              quota_cooldown=float(st.secrets.get("QUOTA_COOLDOWN", 10)))
+
+def _fetch_sheet(sheet_key: str, query: tuple):
+    """Lê da fonte conforme `query` (ver engine.fetch)."""
+    return engine.fetch(_get_source(), sheet_key, query)
 
 @st.cache_data(show_spinner=False, ttl=600)
-def read_sheet_records_by_key(sheet_key: str, tab: str | None):
-    """Lê todos os registros de uma worksheet como lista de dicts (cache 10 min)."""
-    client = _get_client()
-    sh = _with_retry(lambda: client.open_by_key(sheet_key))
-    ws = _with_retry(lambda: (sh.worksheet(tab) if tab else sh.sheet1))
-    rows = _with_retry(lambda: ws.get_all_records())
-    return rows
+def read_sheet_by_key(sheet_key: str, query: tuple):
+    """Lê a planilha conforme `query` (ver _fetch_sheet), com cache de 10 min."""
+    METRICS.inc("sheet_cache_misses")
+    return _fetch_sheet(sheet_key, query)
+
+# --- Ingestão incremental: só baixa de novo quando a revisão (modifiedTime) muda ---
+REVISION_TTL = int(st.secrets.get("REVISION_TTL", 60))
+
+@st.cache_data(show_spinner=False, ttl=REVISION_TTL)
+def sheet_revision(sheet_key: str) -> str | None:
+    """modifiedTime da planilha no Drive (1 chamada leve). None se a Drive API falhar."""
+    METRICS.inc("revision_checks")
+    return _get_source().revision(sheet_key)
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def read_sheet_at_revision(sheet_key: str, query: tuple, revision: str):
+    """Igual a read_sheet_by_key, mas sem TTL: a chave inclui a revisão do Drive."""
+    METRICS.inc("sheet_cache_misses")
+    return _fetch_sheet(sheet_key, query)
+
+def read_sheet(sheet_key: str, query: tuple):
+    """Lê pela revisão quando disponível (meses fechados ficam em cache); senão cai no TTL de 10 min."""
+    METRICS.inc("sheet_reads")
+    rev = sheet_revision(sheet_key)
+    if rev:
+        return read_sheet_at_revision(sheet_key, query, rev)
+    return read_sheet_by_key(sheet_key, query)
 
 # ====== PLANILHA-ÍNDICE ======
-INDEX_SHEET_ID = "1L55P-vJifVEg6BHBGVLd00m3AXsz7hEyCPMA60G6Jms"
-INDEX_TAB_ARQS  = "ARQUIVOS"   # colunas: URL | MÊS | ATIVO
-INDEX_TAB_METAS = "METAS"      # colunas: MÊS | EMPRESA | UNIDADE | DIAS_UTEIS | META_MENSAL
-
-# =================== HELPERS ===================
-ID_RE = re.compile(r"/d/([a-zA-Z0-9-_]+)")
-def _sheet_id(s: str):
-    s = (s or "").strip()
-    m = ID_RE.search(s)
-    if m: return m.group(1)
-    return s if re.fullmatch(r"[A-Za-z0-9-_]{20,}", s) else None
-
-def _ym_token(x):
-    s = str(x).strip()
-    if re.fullmatch(r"\d{2}/\d{4}", s):
-        mm, yy = s.split("/")
-        return f"{yy}-{int(mm):02d}"
-    if re.fullmatch(r"\d{4}-\d{2}", s):
-        return s
-    return None
-
-def parse_date_value(x):
-    # versão segura: aceita floats do Excel sem truncar o dia
-    if pd.isna(x) or x == "": return pd.NaT
-    if isinstance(x, (int,float)) and not isinstance(x,bool):
-        try:
-            base = pd.to_datetime("1899-12-30")
-            return (base + pd.to_timedelta(float(x), unit="D")).date()
-        except: 
-            pass
-    s = str(x).strip()
-    for fmt in ("%d/%m/%Y","%Y-%m-%d","%d-%m-%Y"):
-        try: return datetime.strptime(s, fmt).date()
-        except: pass
-    try: return pd.to_datetime(s).date()
-    except: return pd.NaT
-
-def safe_div(a,b): return (a/b) if b else 0
-def is_workday(d: date) -> bool: return isinstance(d, date) and d.weekday() < 5
-
-# =================== METAS BASE (21 dias) ===================
-metas_unidades_base = {
-    "TOKYO": {"BARRA DO CORDA": 677, "CHAPADINHA": 573, "SANTA INÊS": 2291, "SÃO JOÃO DOS PATOS": 453, "SÃO JOSÉ DE RIBAMAR": 2083},
-    "STARCHECK": {"BACABAL": 1658, "BALSAS": 1642, "CAXIAS": 604, "CODÓ": 446, "PINHEIRO": 917, "SÃO LUÍS": 3272},
-    "LOG": {"AÇAILÂNDIA": 1185, "CAROLINA": 126, "PRESIDENTE DUTRA": 926, "SÃO LUÍS": 4455, "TIMON": 896},
-    "VELOX": {"ESTREITO": 482, "GRAJAÚ": 496, "IMPERATRIZ": 3488, "PEDREIRAS": 625, "SÃO LUÍS": 1926}
-}
-if "VELOX" in metas_unidades_base and "SÃO LÍS" in metas_unidades_base["VELOX"]:
-    metas_unidades_base["VELOX"]["SÃO LUÍS"] = metas_unidades_base["VELOX"].pop("SÃO LÍS")
-BASE_21 = 21
-
-# =================== LER ÍNDICE: ARQUIVOS + METAS (com cache e fail-soft) ===================
-try:
-    rows_arqs = read_sheet_records_by_key(INDEX_SHEET_ID, INDEX_TAB_ARQS)
-except Exception as e:
-    st.error(f"Não foi possível ler a aba ARQUIVOS do índice. Erro: {e}")
-    st.stop()
+INDEX_SHEET_ID = str(st.secrets.get("INDEX_SHEET_ID", engine.INDEX_SHEET_ID))
 
-ativos = [r for r in rows_arqs if str(r.get("ATIVO","S")).strip().upper() in {"S","SIM","Y","YES","TRUE","1"}]
-if len(ativos) == 0:
-    st.error("Planilha-índice vazia (aba ARQUIVOS).")
-    st.stop()
+def read_index() -> tuple[list, list]:
+    """(ARQUIVOS, METAS) pelo read_sheet (com cache); ver engine.read_index."""
+    return engine.read_index(read_sheet, INDEX_SHEET_ID)
 
-dfs = []
-falhas = []
-for r in ativos:
-    sid = _sheet_id(r.get("URL",""))
-    ym  = _ym_token(r.get("MÊS") or r.get("MES"))
-    if not sid:
-        continue
+# =================== LER ÍNDICE: ARQUIVOS (planilhas ativas) ===================
+def read_active_files() -> list:
+    """Linhas ativas da aba ARQUIVOS (IngestError se o índice falhar ou estiver vazio)."""
     try:
-        data_rows = read_sheet_records_by_key(sid, None)  # sheet1
-        data = pd.DataFrame(data_rows)
-        if data.empty:
-            continue
-
-        # padronização básica
-        data.columns = [c.strip() for c in data.columns]
-        if "empresa" in data.columns:
-            data["empresa"] = (data["empresa"].astype(str).str.upper().str.strip().str.replace(r"\s+"," ",regex=True))
-        if "unidade" in data.columns:
-            data["unidade"] = (data["unidade"].astype(str).str.upper().str.strip().str.replace(r"\s+"," ",regex=True))
-
-        # data
-        date_candidates = [c for c in ["data_relatorio","DATA","Data","data"] if c in data.columns]
-        date_col = date_candidates[0] if date_candidates else None
-        data["__data__"] = data[date_col].apply(parse_date_value) if date_col else pd.NaT
-
-        # deduz YM se faltar
-        if ym is None and data["__data__"].notna().any():
-            d = max([d for d in data["__data__"] if pd.notna(d)])
-            ym = f"{d.year}-{d.month:02d}"
-        data["__ym__"] = ym
-
-        # números
-        for col in ["total","revistorias","%_190","qtd_152","qtd_190"]:
-            if col not in data.columns:
-                data[col] = 0
-            data[col] = pd.to_numeric(data[col], errors="coerce").fillna(0)
-
-        dfs.append(data)
+        rows_arqs = read_index()[0]
     except Exception as e:
-        falhas.append((r.get("MÊS") or r.get("MES") or ym or "?", str(e)))
-        # segue o loop
+        raise IngestError(f"Não foi possível ler a aba ARQUIVOS do índice. Erro: {e}") from e
+    return engine.active_files(rows_arqs)
+
+# Leitura concorrente das planilhas de mês (limitada para respeitar a cota do Sheets)
+SHEETS_MAX_WORKERS = max(1, int(st.secrets.get("SHEETS_MAX_WORKERS", 4)))
+
+# --- Cache em disco (Parquet) dos meses já normalizados, por planilha + revisão ---
+CACHE_DIR = Path(str(st.secrets.get("CACHE_DIR", ".cache/vistorias")))
+
+# --- Leitura da cauda: o mês aberto só cresce, então baixa só as linhas novas ---
+TAIL_OVERLAP = 5  # linhas já conhecidas relidas para conferir que nada mudou no fim da planilha
+TAIL_MAX_AGE = int(st.secrets.get("TAIL_MAX_AGE", 3600))  # seg; recarga completa periódica
 
-if falhas:
+@dataclass
+class TailState:
+    n_rows: int          # linhas de dados já lidas
+    fingerprint: str     # hash das últimas min(TAIL_OVERLAP, n_rows) linhas cruas
+    frame: pd.DataFrame  # mês normalizado até n_rows
+    full_at: float       # time.time() da última leitura completa
+    rev: str | None      # revisão da planilha quando o frame foi montado
+    provisional: bool = False  # frame com caudas desde a última leitura completa (não vai ao disco)
+
+@st.cache_resource(show_spinner=False)
+def _tail_states() -> dict:
+    """sheet_id -> TailState das planilhas lidas por este processo."""
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def _tail_reloads() -> dict:
+    """sheet_id -> recargas completas forçadas por idade (entram na versão dos dados)."""
+    return {}
+
+@st.cache_resource(show_spinner=False)
+def _tail_lock() -> threading.Lock:
+    """Trava do estado da cauda, uma por processo (o script reexecuta a cada rerun/sessão)."""
+    return threading.Lock()
+
+def _data_revision(sid: str) -> str | None:
+    """Revisão da planilha na versão dos dados (data_key).
+
+    A cauda não enxerga edições em linhas antigas; um mês montado só com caudas há mais de
+    TAIL_MAX_AGE descarta o estado e ganha um sufixo novo na revisão, o que força um novo
+    snapshot com leitura completa mesmo sem a planilha mudar de novo.
+    """
+    rev = sheet_revision(sid)
+    with _tail_lock():
+        state, reloads = _tail_states().get(sid), _tail_reloads()
+        if state is not None and state.provisional and time.time() - state.full_at > TAIL_MAX_AGE:
+            _tail_states().pop(sid, None)
+            reloads[sid] = reloads.get(sid, 0) + 1
+            METRICS.inc("month_full_reloads")
+        n = reloads.get(sid, 0)
+    return f"{rev}#{n}" if rev and n else rev
+
+def _tail_fingerprint(cols: dict, ini: int, fim: int) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for nome in sorted(cols):
+        h.update(repr((nome, cols[nome][ini:fim])).encode())
+    return h.hexdigest()
+
+def _n_rows(cols: dict) -> int:
+    return max((len(v) for v in cols.values()), default=0)
+
+def read_month_tail(sid: str, ym, state: TailState, rev: str | None):
+    """Mês atualizado lendo só a cauda; None quando precisa de recarga completa.
+
+    Recarrega tudo se as linhas relidas mudaram, se nada foi acrescentado com a revisão nova
+    (edição em outro ponto) ou se a última leitura completa passou de TAIL_MAX_AGE. Sem revisão
+    do Drive, cauda igual e sem linhas novas mantém o frame.
+    """
+    if time.time() - state.full_at > TAIL_MAX_AGE:
+        return None
+    ini = max(state.n_rows - TAIL_OVERLAP, 0)
+    with METRICS.timed("fetch cauda"):
+        cols = read_sheet(sid, ("tail", ini + 2, *MONTH_QUERY[1:]))  # linha 1 = cabeçalho
+    k = state.n_rows - ini
+    m = _n_rows(cols)
+    if _tail_fingerprint(cols, 0, k) != state.fingerprint or m < k or (m == k and rev is not None):
+        return None
+    if m == k:
+        _tail_states()[sid] = replace(state, provisional=True)  # nada novo, mas não conferido por inteiro
+        return state.frame
+    novas = {c: v[k:] for c, v in cols.items()}
+    with METRICS.timed("normalização"):
+        extra = normalize_month_frame(novas, ym or state.frame["__ym__"].iloc[0])
+    data = pd.concat([state.frame, extra], ignore_index=True) if extra is not None else state.frame
+    METRICS.inc("month_tail_reads")
+    METRICS.inc("month_tail_rows", m - k)
+    _tail_states()[sid] = TailState(ini + m, _tail_fingerprint(cols, max(m - TAIL_OVERLAP, 0), m),
+                                    data, state.full_at, rev, provisional=True)
+    return data
+
+def month_tail(sid: str, ym, rev):
+    """Passo da cauda do engine.load_month: None (leitura completa) se o processo ainda não leu o mês.
+
+    Revisão igual à do estado (rebuild por METAS, retry após falhas): o frame já está certo.
+    """
+    state = _tail_states().get(sid)
+    if state is None:
+        return None
+    if rev is not None and rev == state.rev:
+        METRICS.inc("month_memory_hits")
+        return state.frame
+    data = read_month_tail(sid, ym, state, rev)
+    if data is None:
+        METRICS.inc("month_full_reloads")
+    return data
+
+def month_full_read(sid: str, cols: dict, data: pd.DataFrame, rev):
+    """Leitura completa: recomeça o estado da cauda."""
+    n = _n_rows(cols)
+    _tail_states()[sid] = TailState(n, _tail_fingerprint(cols, max(n - TAIL_OVERLAP, 0), n), data,
+                                    time.time(), rev)
+
+def load_month_sheet(r):
+    """Lê e padroniza uma planilha de mês (engine.load_month com o cache do app e a cauda)."""
+    return engine.load_month(read_sheet, r, revision=sheet_revision, cache_dir=CACHE_DIR,
+                             tail=month_tail, on_full=month_full_read)
+
+def prune_tail_states(ativos):
+    """Estado da cauda só para o mês aberto: as planilhas do mês mais recente do índice e as que
+    receberam linhas desde a última leitura completa. Meses fechados e planilhas fora de ARQUIVOS
+    saem da memória (o frame do estado é uma 2ª cópia do mês, além do df_full)."""
+    meses = {_sheet_id(r.get("URL","")): _ym_token(r.get("MÊS") or r.get("MES")) for r in ativos}
+    aberto = max((ym for ym in meses.values() if ym), default=None)
+    with _tail_lock():
+        states = _tail_states()
+        for sid in list(states):
+            if sid not in meses or (meses[sid] != aberto and not states[sid].provisional):
+                states.pop(sid, None)
+        for sid in [s for s in _tail_reloads() if s not in meses]:
+            _tail_reloads().pop(sid, None)
+
+def load_month_sheets(ativos, max_workers=SHEETS_MAX_WORKERS):
+    """Busca todas as planilhas ativas em paralelo; devolve (dfs na ordem do índice, falhas)."""
+    out = engine.load_months(ativos, load_month_sheet, max_workers)
+    prune_tail_states(ativos)
+    return out
+
+# =================== SNAPSHOT COMPARTILHADO (todas as sessões) ===================
+def data_key(ativos) -> tuple:
+    """Versão dos dados: revisão do índice (ARQUIVOS/METAS) + de cada planilha ativa.
+
+    Sem revisão do Drive, usa a janela de 10 min do cache como versão.
+    """
+    return engine.data_key(INDEX_SHEET_ID, ativos, _data_revision, SHEETS_MAX_WORKERS)
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def build_snapshot(key: tuple, _ativos: list, _anterior: DataSnapshot | None = None) -> DataSnapshot:
+    """Ingestão completa (planilhas → df_full, metas, cubo) uma vez por versão dos dados.
+
+    É um recurso do processo: sessões simultâneas com a mesma `key` esperam o mesmo build
+    (o cache do Streamlit trava por chave) em vez de repetir o trabalho.
+    """
+    with METRICS.timed("snapshot: planilhas"):
+        dfs, falhas = load_month_sheets(_ativos)
+    try:
+        metas_rows = read_index()[1]  # mesmo batchGet do ARQUIVOS (já em cache)
+    except Exception as e:  # sem cache do build: a próxima rodada tenta de novo
+        raise IngestError(f"Não foi possível ler a aba METAS do índice. Erro: {e}") from e
+    return engine.assemble_snapshot(dfs, falhas, metas_rows, key, _anterior)
+
+# =================== REFRESH EM SEGUNDO PLANO (stale-while-revalidate) ===================
+REFRESH_INTERVAL = int(st.secrets.get("REFRESH_INTERVAL", 300))  # seg; 0 = revalida a cada rerun
+
+class SnapshotStore:
+    """Último snapshot bom do processo, revalidado por uma thread em segundo plano.
+
+    As sessões leem `current` sem esperar a API; se uma rodada falha, o snapshot anterior
+    continua no ar e o erro fica em `last_error` (não vira st.error/st.stop).
+    """
+
+    def __init__(self):
+        self.current = None
+        self.checked_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._refresh = None
+        self._stop = threading.Event()
+
+    def publish(self, snap: DataSnapshot):
+        with self._lock:
+            self.current = snap
+            self.checked_at, self.last_error = datetime.now(), None
+
+    def checked(self):
+        with self._lock:
+            self.checked_at, self.last_error = datetime.now(), None
+
+    def failed(self, exc: Exception):
+        METRICS.inc("refresh_errors")
+        with self._lock:
+            self.last_error = (datetime.now(), str(exc))
+
+    def start(self, interval: int, refresh):
+        """Sobe a thread (uma por processo). `refresh` é trocado a cada chamada para a thread usar
+        sempre a função do rerun mais recente, sem prender o namespace de execuções antigas."""
+        with self._lock:
+            self._refresh = refresh
+            if self._stop.is_set() or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._loop, args=(interval,),
+                                            name="vistorias-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Encerra a thread (store saiu do cache: "Clear cache" cria outro com thread própria)."""
+        self._stop.set()
+
+    def _loop(self, interval: int):
+        while not self._stop.wait(interval):
+            try:
+                with METRICS.timed("refresh"):
+                    self._refresh(self)
+            except Exception as e:
+                self.failed(e)
+
+@st.cache_resource(show_spinner=False, on_release=SnapshotStore.stop)
+def snapshot_store() -> SnapshotStore:
+    return SnapshotStore()
+
+# --- Snapshot pré-montado (python engine.py --saida ...): vazio = ingestão ao vivo ---
+SNAPSHOT_FILE = str(st.secrets.get("SNAPSHOT_FILE", "")).strip()
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def read_snapshot_file(path: str, mtime_ns: int) -> DataSnapshot:
+    """Artefato gravado pelo engine; relido só quando o arquivo muda (`mtime_ns` na chave)."""
+    with METRICS.timed("snapshot: arquivo"):
+        return engine.load_snapshot(path)
+
+def snapshot_from_file(path: str):
+    """Snapshot do arquivo, ou None se ele não existe / é de outra versão (a ingestão ao vivo assume)."""
+    try:
+        return read_snapshot_file(path, os.stat(path).st_mtime_ns)
+    except Exception:
+        METRICS.inc("snapshot_file_errors")
+        return None
+
+def refresh_snapshot(store: SnapshotStore) -> DataSnapshot:
+    """Relê o índice e as revisões; só remonta o snapshot se a versão mudou.
+
+    Com SNAPSHOT_FILE, só confere o arquivo (o cron refaz o snapshot) e cai para a ingestão
+    ao vivo se ele não puder ser lido. Um snapshot parcial (planilhas com erro) só substitui
+    outro parcial ou a ausência de dados.
+    """
+    atual = store.current
+    if SNAPSHOT_FILE:
+        snap = snapshot_from_file(SNAPSHOT_FILE)
+        if snap is not None:
+            if snap is atual:
+                store.checked()
+            else:
+                store.publish(snap)
+            return snap
+    ativos = read_active_files()
+    key = data_key(ativos)
+    if atual is not None and atual.token == key and not atual.falhas:
+        store.checked()
+        return atual
+    snap = build_snapshot(key, ativos, atual)  # o anterior empresta os meses fechados do rollup
+    if snap.falhas:
+        build_snapshot.clear()  # não fixa um snapshot parcial: a próxima rodada tenta de novo
+        if atual is not None and not atual.falhas:
+            raise IngestError("Planilhas ignoradas na atualização: " +
+                              "; ".join(f"{m}: {err}" for m, err in snap.falhas))
+    store.publish(snap)
+    return snap
+
+STORE = snapshot_store()
+if STORE.current is None or REFRESH_INTERVAL <= 0:
+    try:
+        refresh_snapshot(STORE)
+    except Exception as e:
+        STORE.failed(e)
+        if STORE.current is None:
+            if not isinstance(e, IngestError):
+                raise
+            st.error(str(e))
+            st.stop()
+if REFRESH_INTERVAL > 0:
+    STORE.start(REFRESH_INTERVAL, refresh_snapshot)
+SNAP = STORE.current
+
+if SNAP.falhas:
     st.warning("Algumas planilhas foram ignoradas por erro transitório:\n" +
-               "\n".join([f"- Mês {m}: {err}" for m, err in falhas]))
+               "\n".join([f"- Mês {m}: {err}" for m, err in SNAP.falhas]))
 
-if not dfs:
-    st.error("Nenhuma planilha de mês pôde ser lida.")
-    st.stop()
+_frescor = f"🕒 Dados de {SNAP.built_at:%d/%m %H:%M}"
+if STORE.checked_at is not None:
+    _frescor += f" · conferidos às {STORE.checked_at:%H:%M}"
+if STORE.last_error is not None:
+    _frescor += f" · última atualização falhou às {STORE.last_error[0]:%H:%M} (mantidos os dados anteriores)"
+st.caption(_frescor)
 
-df = pd.concat(dfs, ignore_index=True)
-
-# 👉 Merge: RIACHÃO → BALSAS
-UNIDADE_MERGE_MAP = {"RIACHÃO":"BALSAS","RIACHAO":"BALSAS"}
-if "unidade" in df.columns:
-    df["unidade"] = df["unidade"].replace(UNIDADE_MERGE_MAP)
-
-# --- METAS (aba METAS) ---
-try:
-    metas_rows = read_sheet_records_by_key(INDEX_SHEET_ID, INDEX_TAB_METAS)
-except Exception:
-    metas_rows = []
-
-meta_map = {}  # (ym, EMPRESA, UNIDADE) -> (dias_uteis, meta_mensal)
-for r in metas_rows:
-    ym = _ym_token(r.get("MÊS") or r.get("MES"))
-    emp = str(r.get("EMPRESA","")).strip().upper()
-    uni = str(r.get("UNIDADE","")).strip().upper()
-    if not ym or not emp or not uni:
-        continue
-    du  = r.get("DIAS_UTEIS", "")
-    mm  = r.get("META_MENSAL", "")
-    try: du = int(du) if str(du).strip() != "" else None
-    except: du = None
-    try: mm = int(mm) if str(mm).strip() != "" else None
-    except: mm = None
-    meta_map[(ym, emp, uni)] = (du, mm)
-
-# =================== FUNÇÕES DE META (usam METAS da aba) ===================
-def meta_unidade_mes(empresa: str, unidade: str, ym: str) -> int:
-    base = int(metas_unidades_base.get(empresa, {}).get(unidade, 0))
-    du, mm = meta_map.get((ym, empresa, unidade), (None, None))
-    if mm is not None:
-        return int(mm)
-    du = du if du is not None else BASE_21
-    return int(round(base * (du/BASE_21)))
-
-def dias_uteis_unidade(empresa: str, unidade: str, ym: str) -> int:
-    du, _ = meta_map.get((ym, empresa, unidade), (None, None))
-    return int(du) if du else BASE_21
-
-def meta_marca_mes(empresa: str, ym: str) -> int:
-    unis = metas_unidades_base.get(empresa, {}).keys()
-    return sum(meta_unidade_mes(empresa, u, ym) for u in unis)
-
-# =================== HISTÓRICO COMPLETO ===================
-df_full = df.copy()
+df_full, cube, GOALS = SNAP.df_full, SNAP.cube, SNAP.goals
+GOALS_YMS = set(GOALS["ym"])
+DATA_TOKEN = SNAP.token
+PERF.lap("snapshot")
 
 # =================== SIDEBAR ===================
 st.sidebar.header("📅 Dias úteis do mês")
@@ -249,20 +422,19 @@ dias_uteis_total = int(st.sidebar.slider("Dias úteis no mês (referência geral
 dias_uteis_passados = int(st.sidebar.slider("Dias úteis já passados", 0, 31, 16, step=1, key="dias_passados"))
 
 dias_uteis_restantes = max(dias_uteis_total - dias_uteis_passados, 0)
-mes_encerrado = (dias_uteis_restantes == 0)
 
 # --- Sidebar: mês e dia ---
 st.sidebar.markdown("---")
 st.sidebar.subheader("🗓️ Período")
 
-datas_validas = sorted([d for d in df_full["__data__"] if pd.notna(d)])
-if not datas_validas:
+yms_validos = SNAP.yms
+if not yms_validos:
     st.sidebar.info("Sem coluna de data reconhecida. Exibindo tudo.")
-    df_view = df_full.copy()
+    chave_mes = None  # sem datas: tudo
     daily_mode, chosen_date = False, None
     ym_ref = df_full["__ym__"].dropna().iloc[-1] if df_full["__ym__"].notna().any() else None
 else:
-    meses = sorted({(d.year, d.month) for d in datas_validas})
+    meses = [divmod(ym, 100) for ym in yms_validos]
     labels = [f"{mm:02d}/{yy}" for (yy, mm) in [(y, m) for (y, m) in meses]]
     mes_idx_default = len(labels) - 1
     mes_label = st.sidebar.selectbox("Mês de referência", options=labels, index=mes_idx_default)
@@ -270,8 +442,8 @@ else:
     mm_sel, yy_sel = mes_label.split("/")
     ref_year, ref_month = int(yy_sel), int(mm_sel)
 
-    mask_mes = df_full["__data__"].apply(lambda d: isinstance(d, date) and d.year == ref_year and d.month == ref_month)
-    dias_mes = sorted([d for d in df_full.loc[mask_mes, "__data__"].unique() if pd.notna(d)])
+    chave_mes = ym_int(ref_year, ref_month)
+    dias_mes = SNAP.dias_mes.get(chave_mes, [])
 
     escolha = st.sidebar.selectbox(
         "Data do relatório",
@@ -280,17 +452,19 @@ else:
     )
 
     if escolha == "(Mês inteiro)":
-        df_view = df_full[mask_mes].copy()
         daily_mode, chosen_date = False, None
     else:
-        chosen_date = datetime.strptime(escolha, "%d/%m/%Y").date()
-        df_view = df_full[df_full["__data__"] == chosen_date].copy()
+        chosen_date = pd.Timestamp(datetime.strptime(escolha, "%d/%m/%Y"))
         daily_mode = True
 
     ym_ref = f"{ref_year}-{ref_month:02d}"
 
+def recorte_marca(part: BrandPartition):
+    """Somas por unidade da marca no período da sidebar (None se a marca não tem dado nele)."""
+    return part.por_dia.get(chosen_date) if daily_mode else part.por_mes.get(chave_mes)
+
 # ======== empresa/marca ========
-empresas = sorted(df_view['empresa'].dropna().unique())
+empresas = sorted(e for e, part in SNAP.brands.items() if recorte_marca(part) is not None)
 if len(empresas) == 0:
     st.warning("Não há dados para exibir. Verifique as planilhas.")
     st.stop()
@@ -305,53 +479,46 @@ else:
         st.stop()
     st.info(f"Visualização fixa para a marca **{empresa_selecionada}**")
 
-df_filtrado = df_view[df_view['empresa'] == empresa_selecionada].copy()
-df_marca_all = df_full[df_full["empresa"] == empresa_selecionada].copy()
+PART = SNAP.brands[empresa_selecionada]
+agr_marca = recorte_marca(PART).reset_index(drop=True)  # soma por unidade (já pronta no snapshot)
+cube_marca_all = PART.cube
 
 # mês de referência para metas
 if 'daily_mode' in locals() and daily_mode and 'chosen_date' in locals() and chosen_date:
     ym_ref = f"{chosen_date.year}-{chosen_date.month:02d}"
-elif df_filtrado["__ym__"].notna().any():
-    ym_ref = df_filtrado["__ym__"].dropna().iloc[-1]
+elif PART.ym_token.get(chave_mes) is not None:
+    ym_ref = PART.ym_token[chave_mes]
 else:
     ym_ref = df_full["__ym__"].dropna().iloc[-1]
 
+PERF.lap("filtros")
+
+# =================== PROJEÇÃO (grade what-if dos dias úteis) ===================
+@st.cache_resource(show_spinner=False, max_entries=64)
+def grade_projecao(data_token: tuple, recorte: tuple, _liq, _meta) -> engine.ProjectionGrid:
+    """Projeção/tendência/necessidade para todos os valores dos sliders, uma vez por snapshot e recorte.
+
+    `recorte` identifica as linhas (escopo, período, mês das metas); mover os sliders só indexa a grade.
+    """
+    METRICS.inc("projection_grids")
+    return engine.projection_grid(_liq, _meta)
+
+RECORTE = (chosen_date if daily_mode else chave_mes, ym_ref)
+meta_mes_marca = meta_marca_mes(GOALS, empresa_selecionada, ym_ref)
+metas_agr = metas_unidades_df(GOALS, empresa_selecionada, ym_ref, agr_marca["unidade"])
+# linha 0 = marca; depois as unidades (no modo diário a projeção delas parte do líquido MTD)
+liq_unidades = (agr_marca["liq_mtd"].to_numpy() if daily_mode
+                else agr_marca["total"].astype(int).to_numpy() - agr_marca["rev"].astype(int).to_numpy())
+GRADE_MARCA = grade_projecao(DATA_TOKEN, (empresa_selecionada, *RECORTE),
+                             np.r_[int(agr_marca["total"].sum()) - int(agr_marca["rev"].sum()), liq_unidades],
+                             np.r_[meta_mes_marca, metas_agr["meta_mes"].to_numpy()])
+proj_marca = GRADE_MARCA.at(dias_uteis_total, dias_uteis_passados)
+PERF.lap("projeção")
+
 # =================== CONSOLIDADO (MARCA) ===================
-meta_mes_marca = meta_marca_mes(empresa_selecionada, ym_ref)
-total_geral_marca = int(df_filtrado['total'].sum())
-total_rev_marca   = int(df_filtrado['revistorias'].sum())
-total_liq_marca   = total_geral_marca - total_rev_marca
-
-if 'daily_mode' in locals() and daily_mode:
-    meta_dia_marca = safe_div(meta_mes_marca, dias_uteis_total)
-    faltante_dia = max(int(round(meta_dia_marca)) - total_liq_marca, 0)
-    tendencia = safe_div(total_liq_marca, meta_dia_marca) * 100
-    cards = [
-        ("Meta do Dia", int(round(meta_dia_marca))),
-        ("Total Geral (Dia)", total_geral_marca),
-        ("Total Revistorias (Dia)", total_rev_marca),
-        ("Total Líquido (Dia)", total_liq_marca),
-        ("Faltante (Dia)", faltante_dia),
-        ("Necessidade/dia (Dia)", faltante_dia),
-        ("Projeção (Dia)", total_liq_marca),
-        ("Tendência (Dia)", f"{tendencia:.0f}% {'🚀' if tendencia >= 100 else '😟'}"),
-    ]
-else:
-    faltante_marca = max(meta_mes_marca - total_liq_marca, 0)
-    media_diaria = safe_div(total_liq_marca, dias_uteis_passados)
-    projecao_marca_total = total_liq_marca + media_diaria * dias_uteis_restantes
-    tendencia = safe_div(projecao_marca_total, meta_mes_marca) * 100
-    necessidade_por_dia = 0 if mes_encerrado else int(safe_div(faltante_marca, dias_uteis_restantes))
-    cards = [
-        ("Meta da Marca", meta_mes_marca),
-        ("Total Geral", total_geral_marca),
-        ("Total Revistorias", total_rev_marca),
-        ("Total Líquido", total_liq_marca),
-        ("Faltante", faltante_marca),
-        ("Necessidade/dia", necessidade_por_dia),
-        ("Projeção (Fim do mês)", int(projecao_marca_total)),
-        ("Tendência", f"{tendencia:.0f}% {'🚀' if tendencia >= 100 else '😟'}"),
-    ]
+cards = engine.cards_consolidado(int(agr_marca['total'].sum()), int(agr_marca['rev'].sum()), meta_mes_marca,
+                                 diario=daily_mode, dias_total=dias_uteis_total, dias_passados=dias_uteis_passados,
+                                 proj=tuple(a[0] for a in proj_marca))
 
 st.markdown("""
 <style>
@@ -366,130 +533,66 @@ st.markdown("""
 st.markdown(f"### 🏢 Consolidado - {empresa_selecionada}")
 st.markdown("<div class='card-container'>" + "".join([f"<div class='card'><h4>{t}</h4><h2>{v}</h2></div>" for t,v in cards]) + "</div>", unsafe_allow_html=True)
 
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def sensibilidade_spec(_grade: engine.ProjectionGrid, data_token: tuple, recorte: tuple,
+                       dias_total: int, dias_passados: int) -> dict:
+    """Tendência da marca por dias úteis passados, para o total de dias do slider e vizinhos (Vega-Lite)."""
+    dados = engine.sensitivity_frame(_grade, 0, dias_total).rename(
+        columns={"dias_total": "Dias úteis no mês", "dias_passados": "Dias úteis passados", "tendencia": "Tendência (%)"})
+    atual = dados[(dados["Dias úteis no mês"] == dias_total) & (dados["Dias úteis passados"] == dias_passados)]
+    x = alt.X("Dias úteis passados:Q", title="Dias úteis já passados")
+    y = alt.Y("Tendência (%):Q", title="Tendência (%)")
+    linhas = alt.Chart(dados).mark_line().encode(
+        x=x, y=y, color=alt.Color("Dias úteis no mês:O", title="Dias úteis no mês"),
+        tooltip=["Dias úteis no mês:O", "Dias úteis passados:Q", alt.Tooltip("Tendência (%):Q", format=".0f")])
+    meta = alt.Chart(pd.DataFrame({"y": [100]})).mark_rule(color="#cc3300", strokeDash=[4, 4]).encode(y="y:Q")
+    ponto = alt.Chart(atual).mark_point(size=120, filled=True, color="#222").encode(x=x, y=y)
+    return (linhas + meta + ponto).properties(height=300).to_dict()
+
+if not daily_mode:
+    with st.expander("🎯 Sensibilidade da projeção aos dias úteis"):
+        st.vega_lite_chart(sensibilidade_spec(GRADE_MARCA, DATA_TOKEN, (empresa_selecionada, *RECORTE),
+                                              dias_uteis_total, dias_uteis_passados), use_container_width=True)
+        st.caption("Cada linha é um total de dias úteis no mês; o ponto é a posição atual dos sliders "
+                   "e a linha tracejada, 100% da meta.")
+
+PERF.lap("cards marca")
+
 # =================== TABELA POR UNIDADE ===================
 st.subheader("📍 Indicadores por Unidade")
 
-# MTD no modo dia (para projeção)
-mtd_liq_by_unit = {}
-if 'daily_mode' in locals() and daily_mode and 'chosen_date' in locals() and chosen_date is not None:
-    mask_mtd = df_marca_all["__data__"].apply(lambda d: isinstance(d, date) and d.year==chosen_date.year and d.month==chosen_date.month and d<=chosen_date)
-    df_mtd = df_marca_all[mask_mtd & (df_marca_all["empresa"] == empresa_selecionada)]
-    if len(df_mtd):
-        grp_mtd = (df_mtd.groupby("unidade", dropna=False, as_index=False)
-                        .agg(total=("total","sum"), rev=("revistorias","sum")))
-        grp_mtd["liq"] = (grp_mtd["total"] - grp_mtd["rev"]).astype(int)
-        mtd_liq_by_unit = dict(zip(grp_mtd["unidade"], grp_mtd["liq"]))
-
 # >>> AGRUPAMENTO COM TICKET CORRETO (ponderado por qtd_152 e qtd_190)
-agr = df_filtrado.groupby("unidade", dropna=False, as_index=False).agg(
-    total=("total","sum"),
-    rev=("revistorias","sum"),
-    qtd152=("qtd_152","sum"),
-    qtd190=("qtd_190","sum"),
-    pct190=("%_190","mean")
-)
-
-def calc_ticket(q152, q190):
-    q152 = float(q152); q190 = float(q190)
-    denom = q152 + q190
-    return (q152*152.0 + q190*190.0)/denom if denom > 0 else np.nan
-
-linhas = []
-for _, r in agr.iterrows():
-    unidade = r["unidade"]
-    total = int(r["total"]); rev = int(r["rev"]); liq = total - rev
-
-    meta_mes = meta_unidade_mes(empresa_selecionada, unidade, ym_ref)
-
-    if 'daily_mode' in locals() and daily_mode:
-        du_unit = dias_uteis_unidade(empresa_selecionada, unidade, ym_ref)
-        meta_dia = safe_div(meta_mes, du_unit)
-        faltante = max(int(round(meta_dia)) - liq, 0)
-        tendencia_u = safe_div(liq, meta_dia) * 100 if meta_dia else 0
-        tendencia_txt = f"{tendencia_u:.0f}% {'🚀' if tendencia_u >= 100 else '😟'}"
-        meta_col = int(round(meta_dia))
-        falt_label = "Faltante (Dia)"
-        nec_dia = faltante
-        total_label = "Total (Dia)"; rev_label = "Revistorias (Dia)"; liq_label = "Total Líquido (Dia)"; tend_label = "Tendência (Dia)"
-        mtd_liq_u = int(mtd_liq_by_unit.get(unidade, liq))
-        media_u = safe_div(mtd_liq_u, dias_uteis_passados) if dias_uteis_passados else 0
-        proj_col = int(round(mtd_liq_u + media_u * dias_uteis_restantes))
-    else:
-        faltante = max(meta_mes - liq, 0)
-        media = safe_div(liq, dias_uteis_passados)
-        proj_final = liq + media * dias_uteis_restantes
-        tendencia_u = safe_div(proj_final, meta_mes) * 100 if meta_mes else 0
-        tendencia_txt = f"{tendencia_u:.0f}% {'🚀' if tendencia_u >= 100 else '😟'}"
-        meta_col = meta_mes
-        falt_label = "Faltante (sobre Líquido)"
-        nec_dia = 0 if mes_encerrado else safe_div(faltante, dias_uteis_restantes)
-        total_label = "Total"; rev_label = "Revistorias"; liq_label = "Total Líquido"; tend_label = "Tendência"
-        proj_col = int(round(proj_final))
-
-    # ticket médio ponderado pelo mix 152/190
-    ticket_val = calc_ticket(r["qtd152"], r["qtd190"])
-    ticket_txt = "—"
-    if not np.isnan(ticket_val):
-        ticket_txt = f"R$ {ticket_val:.2f} " + ("✅" if ticket_val >= 161.50 else "❌")
-
-    pct190 = float(r["pct190"]); icon_190 = "✅" if pct190 >= 25 else ("⚠️" if pct190 >= 20 else "❌")
-
-    linhas.append({
-        "Unidade": unidade,
-        "Meta do Dia" if ('daily_mode' in locals() and daily_mode) else "Meta": int(meta_col),
-        total_label: total, rev_label: rev, liq_label: liq,
-        falt_label: int(faltante),
-        "Necessidade/dia": int(nec_dia) if ('daily_mode' in locals() and daily_mode) else round(nec_dia, 1),
-        tend_label: tendencia_txt,
-        "Projeção (Mês)": proj_col,
-        "Ticket Médio (R$)": ticket_txt,
-        "% ≥ R$190": f"{pct190:.0f}% {icon_190}"
-    })
-
-# --- Normalização de chaves para evitar KeyError no gráfico ---
-for r in linhas:
-    # Total Líquido
-    if "Total Líquido (Dia)" in r and "Total Líquido" not in r:
-        r["Total Líquido"] = r["Total Líquido (Dia)"]
-    if "Total Líquido" in r and "Total Líquido (Dia)" not in r:
-        r["Total Líquido (Dia)"] = r["Total Líquido"]
-    # Total
-    if "Total (Dia)" in r and "Total" not in r:
-        r["Total"] = r["Total (Dia)"]
-    if "Total" in r and "Total (Dia)" not in r:
-        r["Total (Dia)"] = r["Total"]
-    # Revistorias
-    if "Revistorias (Dia)" in r and "Revistorias" not in r:
-        r["Revistorias"] = r["Revistorias (Dia)"]
-    if "Revistorias" in r and "Revistorias (Dia)" not in r:
-        r["Revistorias (Dia)"] = r["Revistorias"]
-
-tabela_unidades_df = pd.DataFrame(linhas)
+agr = agr_marca
+
+tabela_unidades_df, liq_label = engine.unit_table(agr, metas_agr, diario=daily_mode, dias_passados=dias_uteis_passados,
+                                                  dias_restantes=dias_uteis_restantes,
+                                                  proj=tuple(a[1:] for a in proj_marca))
+
 st.dataframe(tabela_unidades_df, use_container_width=True)
+PERF.lap("tabela unidades")
+
+# =================== GRÁFICO ===================
+@st.cache_data(show_spinner=False, max_entries=64)
+def producao_spec(unidades: tuple, valores: tuple, titulo: str) -> dict:
+    """Barras do líquido por unidade (spec Vega-Lite, em cache pelos valores do gráfico)."""
+    dados = pd.DataFrame({"Unidade": list(unidades), "Produção": list(valores)})
+    base = alt.Chart(dados).encode(
+        x=alt.X("Unidade:N", sort=None, title="Unidade",
+                axis=alt.Axis(labelAngle=0 if len(unidades) <= 8 else -30)),
+        y=alt.Y("Produção:Q", title="Produção (Líquido)"),
+    )
+    barras = base.mark_bar(color="#1f77b4")
+    rotulos = base.mark_text(dy=-8, fontSize=12, fontWeight="bold").encode(text="Produção:Q")
+    return (barras + rotulos).properties(title=titulo, height=380).to_dict()
 
-# =================== GRÁFICO (matplotlib) ===================
 st.subheader("📊 Produção Realizada por Unidade " + ("(Líquido - Dia)" if ('daily_mode' in locals() and daily_mode) else "(Líquido)"))
-unidades = [d.get("Unidade", "—") for d in linhas]
-
-# Blindagem: tenta pegar a métrica do contexto e cai para a outra chave se necessário
-prod_liq = []
-for dct in linhas:
-    if 'daily_mode' in locals() and daily_mode:
-        val = dct.get("Total Líquido (Dia)", dct.get("Total Líquido", 0))
-    else:
-        val = dct.get("Total Líquido", dct.get("Total Líquido (Dia)", 0))
-    prod_liq.append(int(val) if pd.notna(val) else 0)
-
-fig, ax = plt.subplots(figsize=(10,5))
-barras = ax.bar(unidades, prod_liq)
-for b in barras:
-    h = b.get_height()
-    ax.annotate(f'{int(h)}', xy=(b.get_x()+b.get_width()/2, h), xytext=(0,5),
-                textcoords="offset points", ha='center', va='bottom', fontsize=10, fontweight='bold')
-plt.xticks(rotation=0 if len(unidades) <= 8 else 30)
-ax.set_ylabel("Produção (Líquido)"); ax.set_xlabel("Unidade")
-ax.set_title("Produção por Unidade" + (" - Dia" if ('daily_mode' in locals() and daily_mode) else ""))
-st.pyplot(fig)
+unidades = tabela_unidades_df["Unidade"].tolist()
+prod_liq = tabela_unidades_df[liq_label].fillna(0).astype(int).tolist()
+st.vega_lite_chart(producao_spec(tuple(unidades), tuple(prod_liq),
+                                 "Produção por Unidade" + (" - Dia" if ('daily_mode' in locals() and daily_mode) else "")),
+                   use_container_width=True)
+PERF.lap("gráfico")
 
 # =================== CONSOLIDADO GERAL (apenas no app ALL) ===================
 # >>> alteração 3: esconder quando BRAND_SCOPE != ALL
@@ -497,49 +600,85 @@ if BRAND_SCOPE == "ALL":
     st.markdown("---")
     st.markdown("## 🏢 Consolidado Geral - Total das 4 Marcas")
 
-    agg_geral = df_view.groupby("empresa", dropna=False).agg(total=("total","sum"), rev=("revistorias","sum")).reset_index()
-    real_total = int(agg_geral["total"].sum())
-    rev_total  = int(agg_geral["rev"].sum())
-    liq_total  = int(real_total - rev_total)
-
-    meta_mes_geral = sum(meta_marca_mes(m, ym_ref) for m in metas_unidades_base.keys())
-
-    if 'daily_mode' in locals() and daily_mode:
-        meta_dia_geral = safe_div(meta_mes_geral, dias_uteis_total)
-        falt_geral = max(int(round(meta_dia_geral)) - liq_total, 0)
-        tendencia_g = safe_div(liq_total, meta_dia_geral) * 100
-        geral_cards = [
-            ("Meta do Dia (Geral)", int(round(meta_dia_geral))), ("Total Geral (Dia)", real_total),
-            ("Total Revistorias (Dia)", rev_total), ("Total Líquido (Dia)", liq_total),
-            ("Faltante (Dia)", falt_geral), ("Necessidade/dia (Dia)", falt_geral),
-            ("Projeção (Dia)", liq_total), ("Tendência (Dia)", f"{tendencia_g:.0f}% {'🚀' if tendencia_g >= 100 else '😟'}"),
-        ]
-    else:
-        falt_geral = max(meta_mes_geral - liq_total, 0)
-        media_g = safe_div(liq_total, dias_uteis_passados)
-        proj_g_total = liq_total + media_g * dias_uteis_restantes
-        tendencia_g = safe_div(proj_g_total, meta_mes_geral) * 100
-        necessidade_g = 0 if mes_encerrado else int(safe_div(falt_geral, dias_uteis_restantes))
-        geral_cards = [
-            ("Meta Geral", meta_mes_geral), ("Total Geral", real_total), ("Total Revistorias", rev_total),
-            ("Total Líquido", liq_total), ("Faltante", falt_geral),
-            ("Necessidade/dia", necessidade_g),
-            ("Projeção (Fim do mês)", int(proj_g_total)), ("Tendência", f"{tendencia_g:.0f}% {'🚀' if tendencia_g >= 100 else '😟'}"),
-        ]
+    recortes = [r for r in map(recorte_marca, SNAP.brands.values()) if r is not None]
+    real_total = int(sum(r["total"].sum() for r in recortes))
+    rev_total  = int(sum(r["rev"].sum() for r in recortes))
+    meta_mes_geral = int(metas_marcas_mes(GOALS, ym_ref).sum())
+    grade_geral = grade_projecao(DATA_TOKEN, ("geral", *RECORTE), [real_total - rev_total], [meta_mes_geral])
+    geral_cards = engine.cards_consolidado(real_total, rev_total, meta_mes_geral, diario=daily_mode,
+                                           dias_total=dias_uteis_total, dias_passados=dias_uteis_passados,
+                                           escopo="geral",
+                                           proj=tuple(a[0] for a in grade_geral.at(dias_uteis_total, dias_uteis_passados)))
 
     st.markdown("<div class='card-container'>" + "".join([f"<div class='card'><h4>{t}</h4><h2>{v}</h2></div>" for t,v in geral_cards]) + "</div>", unsafe_allow_html=True)
 
+PERF.lap("consolidado geral")
+
 # =================== HEATMAP ===================
 st.markdown("---")
 st.markdown("<div class='section-title'>📅 Heatmap do Mês (Calendário)</div>", unsafe_allow_html=True)
 
 HEAT_W, HEAT_H = 980, 420
 MIN_PCT = 60
-
-datas_marca = sorted([d for d in df_marca_all["__data__"].unique() if pd.notna(d)])
-if datas_marca:
-    last_date = datas_marca[-1]
-    months_available = sorted({(d.year, d.month) for d in datas_marca})
+HEAT_VISOES = {"Mês": 0, "Últimos 3 meses": 2, "Ano": None}  # meses antes do de referência (None = ano todo)
+MES_ABREV = ["Jan","Fev","Mar","Abr","Mai","Jun","Jul","Ago","Set","Out","Nov","Dez"]
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def heatmap_spec(_cube_src: pd.DataFrame, data_token: tuple, empresa: str, unidade: str,
+                 inicio: pd.Timestamp, fim: pd.Timestamp, metric: str, show_values: bool,
+                 metas_dia: dict) -> dict:
+    """Spec Vega-Lite do calendário (um mês ou vários), em cache por marca/unidade/período/métrica."""
+    cal_df = engine.calendar_frame(engine.daily_liq(_cube_src, unidade, inicio, fim), inicio, fim, metas_dia,
+                                   metric, show_values)
+
+    color_scale = alt.Scale(scheme='viridis', domain=[MIN_PCT, 120], clamp=True) if metric == HEAT_PCT else alt.Scale(scheme='viridis')
+    color_title = '%' if metric == HEAT_PCT else 'Líquido'
+    tooltip = [alt.Tooltip('date:T', title='Data'),
+               alt.Tooltip('liq:Q',  title='Líquido', format='.0f'),
+               alt.Tooltip('pct:Q',  title='% Meta',  format='.0f')]
+
+    if (inicio.year, inicio.month) == (fim.year, fim.month):
+        # mês: semanas nas linhas, dias da semana nas colunas
+        base = alt.Chart(cal_df).properties(width=HEAT_W, height=HEAT_H)
+        x = alt.X('dow_label:N', title='', scale=alt.Scale(domain=HEAT_DOW))
+        y = alt.Y('week_index:O', title='', sort=alt.SortField('week_index', order='ascending'), axis=None)
+        heat = base.mark_rect().encode(x=x, y=y, color=alt.Color('value:Q', title=color_title, scale=color_scale),
+                                       tooltip=tooltip)
+        labels_day = base.mark_text(baseline='middle', dy=-8, fontSize=12, color='black').encode(x='dow_label:N', y='week_index:O', text='day:Q')
+        chart = heat + labels_day
+        if show_values:
+            labels_val = base.mark_text(baseline='middle', dy=10, fontSize=11, color='white',
+                                        stroke='white', strokeWidth=0.8).encode(x='dow_label:N', y='week_index:O', text='val_label_str:N')
+            chart = chart + labels_val
+        max_week = int(cal_df["week_index"].max()) if len(cal_df) else 5
+        grid_df = pd.DataFrame({"dow_label": HEAT_DOW * (max_week + 1),
+                                "week_index": np.repeat(np.arange(max_week + 1), len(HEAT_DOW))})
+        grid = alt.Chart(grid_df).mark_rect(stroke="#E6E6E6", strokeWidth=1, fillOpacity=0).encode(x=x, y=y
+        ).properties(width=HEAT_W, height=HEAT_H)
+        return (grid + chart).to_dict()
+
+    # vários meses: semanas nas colunas, dias da semana nas linhas (estilo "contribuições")
+    n_sem = int(cal_df["week_index"].max()) + 1
+    base = alt.Chart(cal_df).properties(width=HEAT_W, height=max(7 * 18, HEAT_H // 3))
+    x = alt.X('week_index:O', title='', axis=None, scale=alt.Scale(domain=list(range(n_sem))))
+    y = alt.Y('dow_label:N', title='', scale=alt.Scale(domain=HEAT_DOW))
+    grid = base.mark_rect(stroke="#E6E6E6", strokeWidth=1, fillOpacity=0).encode(x=x, y=y)
+    heat = base.mark_rect().encode(x=x, y=y, color=alt.Color('value:Q', title=color_title, scale=color_scale),
+                                   tooltip=tooltip)
+    inicio_mes = cal_df[cal_df["day"] == 1]
+    meses = alt.Chart(pd.DataFrame({"week_index": inicio_mes["week_index"].to_numpy(),
+                                    "mes": [f"{MES_ABREV[d.month - 1]}/{d.year % 100:02d}" for d in inicio_mes["date"]],
+                                    "dow_label": HEAT_DOW[0]})
+    ).mark_text(align='left', dy=-16, fontSize=11, color='gray').encode(x=x, y=y, text='mes:N')
+    chart = grid + heat + meses
+    if show_values:
+        chart = chart + base.mark_text(baseline='middle', fontSize=8, color='white').encode(x=x, y=y, text='val_label_str:N')
+    return chart.to_dict()
+
+yms_marca = PART.yms
+if yms_marca:
+    last_date = PART.last_date
+    months_available = [divmod(ym, 100) for ym in yms_marca]
     month_labels = [f"{y}-{m:02d}" for (y,m) in months_available]
     default_month = f"{last_date.year}-{last_date.month:02d}"
     default_idx = month_labels.index(default_month) if default_month in month_labels else len(month_labels)-1
@@ -548,214 +687,213 @@ if datas_marca:
 else:
     today = date.today()
     ref_year, ref_month = today.year, today.month
+month_start = pd.Timestamp(ref_year, ref_month, 1)
+month_end   = pd.Timestamp(ref_year, ref_month, calendar.monthrange(ref_year, ref_month)[1])
 
-unidades_da_marca = sorted([u for u in df_marca_all["unidade"].dropna().unique().tolist()])
-unidade_heat = st.selectbox("Escopo do heatmap", options=["(Consolidado da Marca)"] + unidades_da_marca, index=0, key="heatmap_unidade")
+unidades_da_marca = PART.unidades
 
-if unidade_heat == "(Consolidado da Marca)":
-    df_heat_src = df_marca_all.copy()
-    meta_mes_ref = meta_marca_mes(empresa_selecionada, f"{ref_year}-{ref_month:02d}")
-    titulo_escopo = empresa_selecionada
-else:
-    df_heat_src = df_marca_all[df_marca_all["unidade"] == unidade_heat].copy()
-    meta_mes_ref = meta_unidade_mes(empresa_selecionada, unidade_heat, f"{ref_year}-{ref_month:02d}")
-    titulo_escopo = f"{empresa_selecionada} — {unidade_heat}"
-
-mask_month = df_heat_src["__data__"].apply(lambda d: isinstance(d, date) and d.year==ref_year and d.month==ref_month)
-df_month = df_heat_src[mask_month].copy()
-
-if len(df_month) > 0:
-    tmp = (df_month.groupby("__data__", as_index=False).agg(total=("total","sum"), rev=("revistorias","sum")))
-    tmp["liq"] = (tmp["total"] - tmp["rev"]).astype(int)
-    daily_liq = tmp[["__data__","liq"]]
-    last_data_day = daily_liq["__data__"].max()
-else:
-    daily_liq = pd.DataFrame(columns=["__data__","liq"]); last_data_day = None
+@st.fragment
+def secao_heatmap(empresa: str, cube_marca_all: pd.DataFrame, unidades_da_marca: list,
+                  month_start: pd.Timestamp, month_end: pd.Timestamp, dias_uteis_total: int, data_token: tuple):
+    """Controles + calendário; mexer nos controles daqui só reroda este bloco."""
+    with PERF.section("heatmap"):
+        unidade_heat = st.selectbox("Escopo do heatmap", options=[CONSOLIDADO] + unidades_da_marca, index=0, key="heatmap_unidade")
+        visao_heat = st.radio("Período do calendário", list(HEAT_VISOES), horizontal=True, key="heatmap_visao")
+        metric_choice = st.radio("Cor do heatmap baseada em:", [HEAT_PCT,"Total Líquido"], horizontal=True, key="heatmap_metric")
+        show_values = st.checkbox("Mostrar valor dentro das células", value=False, key="heatmap_labels")
 
-metric_choice = st.radio("Cor do heatmap baseada em:", ["% da meta do dia","Total Líquido"], horizontal=True, key="heatmap_metric")
-show_values = st.checkbox("Mostrar valor dentro das células", value=False, key="heatmap_labels")
+        if HEAT_VISOES[visao_heat] is None:
+            heat_inicio, heat_fim = pd.Timestamp(month_start.year, 1, 1), pd.Timestamp(month_start.year, 12, 31)
+        else:
+            heat_inicio, heat_fim = month_start - pd.DateOffset(months=HEAT_VISOES[visao_heat]), month_end
 
-meta_dia_base = (meta_mes_ref / dias_uteis_total) if dias_uteis_total else 0
+        metas_dia_heat = engine.metas_dia_periodo(GOALS, empresa, unidade_heat, heat_inicio, heat_fim, dias_uteis_total)
 
-first_weekday, n_days = calendar.monthrange(ref_year, ref_month)
-liq_map = daily_liq.set_index("__data__")["liq"].to_dict()
+        st.vega_lite_chart(heatmap_spec(cube_marca_all, data_token, empresa, unidade_heat, heat_inicio, heat_fim,
+                                        metric_choice, show_values, metas_dia_heat),
+                           use_container_width=False)
+        st.caption(f"Escopo: {empresa if unidade_heat==CONSOLIDADO else f'{empresa} — {unidade_heat}'}")
 
-records = []
-ord_dow = ["Seg","Ter","Qua","Qui","Sex","Sáb","Dom"]
-for day in range(1, n_days+1):
-    d0 = date(ref_year, ref_month, day)
-    if (last_data_day is None) or (d0 > last_data_day) or (d0 not in liq_map):
-        liq = np.nan
-    else:
-        liq = float(liq_map[d0])
-    pct = (liq / meta_dia_base * 100) if (not np.isnan(liq) and meta_dia_base) else np.nan
-    dow_idx = d0.weekday()
-    dow_label = ord_dow[dow_idx]
-    week_index = (day + first_weekday - 1)//7
-    if metric_choice == "% da meta do dia":
-        value = pct if (not np.isnan(pct) and dow_idx < 5) else np.nan
-        val_label_str = f"{pct:.0f}%" if (show_values and not np.isnan(pct) and dow_idx < 5) else ""
-    else:
-        value = liq if not np.isnan(liq) else np.nan
-        val_label_str = f"{int(liq)}" if (show_values and not np.isnan(liq)) else ""
-    records.append({"date": pd.to_datetime(d0), "day": day, "dow_label": dow_label, "week_index": week_index,
-                    "liq": liq, "pct": pct, "value": value, "val_label_str": val_label_str})
-
-cal_df = pd.DataFrame.from_records(records)
-
-base = alt.Chart(cal_df).properties(width=HEAT_W, height=HEAT_H)
-color_scale = alt.Scale(scheme='viridis', domain=[MIN_PCT, 120], clamp=True) if metric_choice=="% da meta do dia" else alt.Scale(scheme='viridis')
-color_title = '%' if metric_choice=="% da meta do dia" else 'Líquido'
-
-heat = base.mark_rect().encode(
-    x=alt.X('dow_label:N', title='', scale=alt.Scale(domain=ord_dow)),
-    y=alt.Y('week_index:O', title='', sort=alt.SortField('week_index', order='ascending'), axis=None),
-    color=alt.Color('value:Q', title=color_title, scale=color_scale),
-    tooltip=[alt.Tooltip('date:T', title='Data'),
-             alt.Tooltip('liq:Q',  title='Líquido', format='.0f'),
-             alt.Tooltip('pct:Q',  title='% Meta',  format='.0f')]
-)
-labels_day = base.mark_text(baseline='middle', dy=-8, fontSize=12, color='black').encode(x='dow_label:N', y='week_index:O', text='day:Q')
-chart = heat + labels_day
-if show_values:
-    labels_val = base.mark_text(baseline='middle', dy=10, fontSize=11, color='white',
-                                stroke='white', strokeWidth=0.8).encode(x='dow_label:N', y='week_index:O', text='val_label_str:N')
-    chart = chart + labels_val
-
-max_week = int(cal_df["week_index"].max()) if len(cal_df) else 5
-grid_records = [{"dow_label": d, "week_index": w} for w in range(max_week+1) for d in ord_dow]
-grid_df = pd.DataFrame(grid_records)
-grid = alt.Chart(grid_df).mark_rect(stroke="#E6E6E6", strokeWidth=1, fillOpacity=0).encode(
-    x=alt.X('dow_label:N', title='', scale=alt.Scale(domain=ord_dow)),
-    y=alt.Y('week_index:O', title='', sort=alt.SortField('week_index', order='ascending'), axis=None)
-).properties(width=HEAT_W, height=HEAT_H)
-
-st.altair_chart(grid + chart, use_container_width=False)
-st.caption(f"Escopo: {empresa_selecionada if unidade_heat=='(Consolidado da Marca)' else f'{empresa_selecionada} — {unidade_heat}'}")
+secao_heatmap(empresa_selecionada, cube_marca_all, unidades_da_marca, month_start, month_end, dias_uteis_total, DATA_TOKEN)
 
 # =================== CATCH-UP ===================
-st.markdown("<div class='section-title'>📋 Acompanhamento Diário com Meta Ajustada (Catch-up)</div>", unsafe_allow_html=True)
-
-unidades_marca = ["(Consolidado da Marca)"] + sorted(df_marca_all["unidade"].dropna().unique().tolist())
-un_sel = st.selectbox("Unidade", options=unidades_marca, index=0, key="un_meta_tab")
-
-mask_month_brand = df_marca_all["__data__"].apply(lambda d: isinstance(d, date) and d.year==ref_year and d.month==ref_month)
-df_month_brand = df_marca_all[mask_month_brand].copy()
-if un_sel != "(Consolidado da Marca)":
-    df_month_brand = df_month_brand[df_month_brand["unidade"] == un_sel]
-
-daily_series = (df_month_brand.groupby("__data__").apply(lambda x: int(x["total"].sum() - x["revistorias"].sum())).sort_index())
-
-if un_sel == "(Consolidado da Marca)":
-    meta_mes_ref = meta_marca_mes(empresa_selecionada, f"{ref_year}-{ref_month:02d}")
-    du_ref = dias_uteis_total
-else:
-    meta_mes_ref = meta_unidade_mes(empresa_selecionada, un_sel, f"{ref_year}-{ref_month:02d}")
-    du_ref = dias_uteis_unidade(empresa_selecionada, un_sel, f"{ref_year}-{ref_month:02d}")
-
-meta_dia_const = safe_div(meta_mes_ref, du_ref)
-
-month_start = date(ref_year, ref_month, 1)
-month_end   = date(ref_year, ref_month, calendar.monthrange(ref_year, ref_month)[1])
-all_days = pd.date_range(month_start, month_end, freq="D")
-workdays_dates = [ts.date() for ts in all_days if is_workday(ts.date())]
-
-remaining_map = {wd: (len(workdays_dates)-i) for i, wd in enumerate(workdays_dates)}
-
-rows = []
-acum_real = 0
-for d0, liq in daily_series.items():
-    if d0 in remaining_map:
-        meta_dia_ajustada = safe_div((meta_mes_ref - acum_real), remaining_map[d0])
-    else:
-        meta_dia_ajustada = 0
-    diff_dia = liq - meta_dia_ajustada
-    acum_real += liq
-    saldo_restante = meta_mes_ref - acum_real
-    rows.append({
-        "Data": d0.strftime("%d/%m/%Y"),
-        "Meta (constante)": round(meta_dia_const, 1),
-        "Meta Ajustada (catch-up)": round(meta_dia_ajustada, 1),
-        "Realizado Líquido": int(liq),
-        "Δ do Dia (Real − Meta Aj.)": round(diff_dia, 1),
-        "Acumulado Líquido": int(acum_real),
-        "Saldo p/ Bater Meta": int(saldo_restante),
-        "Status": "✅" if liq >= meta_dia_ajustada and meta_dia_ajustada > 0 else ("—" if meta_dia_ajustada == 0 else "❌")
-    })
-st.dataframe(pd.DataFrame(rows), use_container_width=True)
-
-# =================== RANKING DIÁRIO ===================
-st.markdown("<div class='section-title'>🏆 Ranking Diário por Unidade (Tendência do Dia e Variação vs Ontem)</div>", unsafe_allow_html=True)
-
-if 'daily_series' in locals() and len(daily_series):
-    if 'daily_mode' in locals() and daily_mode and 'chosen_date' in locals() and chosen_date and (chosen_date.year==ref_year and chosen_date.month==ref_month):
-        rank_date = chosen_date
-    else:
-        rank_date = max(daily_series.index) if len(daily_series) else None
-else:
-    rank_date = None
-
-if rank_date is None:
-    st.info("Ainda não há dados neste mês para montar o ranking.")
-else:
-    df_unit_daily = (df_marca_all
-        .groupby(["unidade","__data__"])
-        .apply(lambda x: int(x["total"].sum() - x["revistorias"].sum()))
-        .rename("liq").reset_index())
-
-    today_df = df_unit_daily[df_unit_daily["__data__"] == rank_date].copy()
-
-    def last_workday_with_data(u):
-        prevs = df_unit_daily[(df_unit_daily["unidade"] == u) & (df_unit_daily["__data__"] < rank_date)]
-        prevs = prevs[prevs["__data__"].apply(is_workday)]
-        if len(prevs) == 0: return None, 0
-        row = prevs.sort_values("__data__").iloc[-1]
-        return row["__data__"], row["liq"]
-
-    prev_map = []
-    for u in today_df["unidade"].unique():
-        dprev, liqprev = last_workday_with_data(u)
-        prev_map.append({"unidade": u, "__data_prev__": dprev, "liq_prev": liqprev})
-    prev_df = pd.DataFrame(prev_map)
-
-    metas_u = []
-    for u in today_df["unidade"].unique():
-        metas_u.append({"unidade": u, "meta_mes": meta_unidade_mes(empresa_selecionada, u, ym_ref),
-                        "du": dias_uteis_unidade(empresa_selecionada, u, ym_ref)})
-    metas_u = pd.DataFrame(metas_u)
-
-    df_rank = (today_df.merge(prev_df, on="unidade", how="left").merge(metas_u, on="unidade", how="left"))
-    df_rank["meta_dia"] = np.where(df_rank["du"]>0, df_rank["meta_mes"]/df_rank["du"], 0)
-
-    workday_rank = is_workday(rank_date)
-    df_rank["pct_hoje"] = np.where(df_rank["meta_dia"]>0, (df_rank["liq"]/df_rank["meta_dia"])*100, 0.0)
-    df_rank["pct_ontem"] = np.where((df_rank["meta_dia"]>0) & df_rank["__data_prev__"].notna(),
-                                    (df_rank["liq_prev"]/df_rank["meta_dia"])*100, np.nan)
-    df_rank["delta_pct"] = df_rank["pct_hoje"] - df_rank["pct_ontem"]
-
-    order_col = "pct_hoje" if workday_rank else "liq"
-    df_rank = df_rank.sort_values(order_col, ascending=False)
-
-    col1, col2 = st.columns(2)
-
-    def fmt_delta(x):
-        if pd.isna(x): return "—"
-        arrow = "⬆️" if x > 0 else ("⬇️" if x < 0 else "➡️")
-        return f"{arrow} {abs(x):.0f} pp"
-
-    def render_rank(df_sub, title, container):
-        with container:
-            st.markdown(f"**{title} — {rank_date.strftime('%d/%m/%Y')}**")
-            linhas_rank = []
-            for _, r in df_sub.iterrows():
-                linhas_rank.append({
-                    "Unidade": r["unidade"],
-                    "% do Dia": f"{r['pct_hoje']:.0f}%" if workday_rank else "—",
-                    "Δ vs Ontem": fmt_delta(r["delta_pct"]) if workday_rank else "—",
-                    "Líquido (Dia)": int(r["liq"]),
-                    "Meta do Dia": int(round(r["meta_dia"])) if (workday_rank and r["meta_dia"]>0) else 0
+@st.cache_data(show_spinner=False, max_entries=32)
+def catchup_table(_cube_month: pd.DataFrame, data_token: tuple, empresa: str, year: int, month: int,
+                  metas_escopo: dict) -> pd.DataFrame:
+    """Catch-up do mês para o consolidado e todas as unidades da marca (ver engine.catchup_frame)."""
+    return engine.catchup_frame(_cube_month, year, month, metas_escopo)
+
+RANK_N = 5
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def ranking_table(_unit_daily: pd.DataFrame, data_token: tuple, empresa: str, rank_date: pd.Timestamp,
+                  ym: str) -> pd.DataFrame:
+    """Unidades da marca no dia: líquido, meta do dia, % de hoje/ontem, já ordenadas."""
+    return engine.ranking_frame(_unit_daily, GOALS, empresa, rank_date, ym)
+
+def fmt_delta(x):
+    if pd.isna(x): return "—"
+    arrow = "⬆️" if x > 0 else ("⬇️" if x < 0 else "➡️")
+    return f"{arrow} {abs(x):.0f} pp"
+
+@st.fragment
+def secao_catchup_ranking(empresa: str, cube_marca_all: pd.DataFrame, unidades_marca: list,
+                          month_start: pd.Timestamp, month_end: pd.Timestamp, dias_uteis_total: int,
+                          rank_fixo, ym_ref: str, data_token: tuple, unit_daily: pd.DataFrame):
+    """Catch-up + ranking (o ranking usa o último dia do escopo escolhido no catch-up).
+
+    `rank_fixo` é o dia escolhido no modo diário, quando cai no mês de referência.
+    """
+    with PERF.section("catch-up"):
+        st.markdown("<div class='section-title'>📋 Acompanhamento Diário com Meta Ajustada (Catch-up)</div>", unsafe_allow_html=True)
+        un_sel = st.selectbox("Unidade", options=unidades_marca, index=0, key="un_meta_tab")
+
+        cube_month_brand = rows_periodo(cube_marca_all, month_start, month_end)
+        ym_heat = f"{month_start.year}-{month_start.month:02d}"
+        metas_escopo = engine.metas_escopo(GOALS, empresa, ym_heat, cube_month_brand["unidade"].dropna().unique(),
+                                           dias_uteis_total)
+
+        catchup_all = catchup_table(cube_month_brand, data_token, empresa, month_start.year, month_start.month, metas_escopo)
+        catchup_sel = catchup_all[catchup_all["escopo"] == un_sel]
+        daily_series = catchup_sel.set_index("__data__")["liq"]
+
+        st.dataframe(catchup_sel[CATCHUP_COLS].reset_index(drop=True), use_container_width=True)
+
+    # =================== RANKING DIÁRIO ===================
+    with PERF.section("ranking"):
+        st.markdown("<div class='section-title'>🏆 Ranking Diário por Unidade (Tendência do Dia e Variação vs Ontem)</div>", unsafe_allow_html=True)
+
+        if len(daily_series):
+            rank_date = rank_fixo if rank_fixo is not None else max(daily_series.index)
+        else:
+            rank_date = None
+
+        if rank_date is None:
+            st.info("Ainda não há dados neste mês para montar o ranking.")
+            return
+
+        # liq do dia + último dia útil anterior com dado, já calculados para todos os dias/unidades
+        df_rank = ranking_table(unit_daily, data_token, empresa, rank_date, ym_ref)
+        workday_rank = is_workday(rank_date)
+        order_col = "pct_hoje" if workday_rank else "liq"
+
+        col1, col2 = st.columns(2)
+
+        def render_rank(df_sub, title, container):
+            with container:
+                st.markdown(f"**{title} — {rank_date.strftime('%d/%m/%Y')}**")
+                tabela_rank = pd.DataFrame({
+                    "Unidade": df_sub["unidade"],
+                    "% do Dia": df_sub["pct_hoje"].map(lambda v: f"{v:.0f}%") if workday_rank else "—",
+                    "Δ vs Ontem": df_sub["delta_pct"].map(fmt_delta) if workday_rank else "—",
+                    "Líquido (Dia)": df_sub["liq"].astype(int),
+                    "Meta do Dia": (np.where(df_sub["meta_dia"]>0, df_sub["meta_dia"].round(), 0).astype(int)
+                                    if workday_rank else 0),
                 })
-            st.dataframe(pd.DataFrame(linhas_rank), use_container_width=True)
-
-    render_rank(df_rank.head(5), "TOP 5", col1)
-    render_rank(df_rank.tail(5).sort_values(order_col, ascending=True), "BOTTOM 5", col2)
+                st.dataframe(tabela_rank.reset_index(drop=True), use_container_width=True)
+
+        render_rank(df_rank.head(RANK_N), f"TOP {RANK_N}", col1)
+        render_rank(df_rank.tail(RANK_N).sort_values(order_col, ascending=True), f"BOTTOM {RANK_N}", col2)
+
+unidades_marca = [CONSOLIDADO] + PART.unidades
+daily_no_mes = ('daily_mode' in locals() and daily_mode and 'chosen_date' in locals() and chosen_date
+                and (chosen_date.year==ref_year and chosen_date.month==ref_month))
+secao_catchup_ranking(empresa_selecionada, cube_marca_all, unidades_marca, month_start, month_end, dias_uteis_total,
+                      chosen_date if daily_no_mes else None, ym_ref, DATA_TOKEN, SNAP.unit_daily)
+
+# =================== TENDÊNCIA MENSAL (YoY / MoM) ===================
+# métrica -> (coluna do rollup, variação em pontos percentuais?)
+TREND_METRICAS = {"Total Líquido": ("liq", False), "Atingimento da meta": ("atingimento", True),
+                  "Revistorias": ("rev", False), "Ticket Médio (R$)": ("ticket", False),
+                  "% ≥ R$190": ("pct190", True)}
+
+def fmt_var(x, pontos: bool):
+    if pd.isna(x): return "—"
+    if pontos: return fmt_delta(x)
+    arrow = "⬆️" if x > 0 else ("⬇️" if x < 0 else "➡️")
+    return f"{arrow} {abs(x):.1f}%"
+
+def fmt_metrica(v, col: str):
+    if pd.isna(v): return "—"
+    if col == "ticket": return f"R$ {v:.2f}"
+    if col in ("atingimento", "pct190"): return f"{v:.0f}%"
+    return f"{int(v)}"
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def tendencia(_rollup: pd.DataFrame, data_token: tuple, empresa: str, unidade: str, metrica: str):
+    """(spec do gráfico ano a ano, tabela com MoM/YoY) de uma métrica, a partir do rollup mensal."""
+    col, pontos = TREND_METRICAS[metrica]
+    tab = engine.trend_table(engine.trend_series(_rollup, GOALS, empresa, unidade)[col], pontos)
+    dados = pd.DataFrame({"Ano": (tab["ym"] // 100).astype(str),
+                          "Mês": [MES_ABREV[m - 1] for m in tab["ym"] % 100],
+                          "valor": tab["valor"]})
+    spec = alt.Chart(dados).mark_line(point=True).encode(
+        x=alt.X("Mês:N", title="", scale=alt.Scale(domain=MES_ABREV)),
+        y=alt.Y("valor:Q", title=metrica),
+        color=alt.Color("Ano:N", title="Ano"),
+        tooltip=[alt.Tooltip("Ano:N"), alt.Tooltip("Mês:N"), alt.Tooltip("valor:Q", title=metrica, format=".1f")],
+    ).properties(height=320).to_dict()
+    tabela = pd.DataFrame({
+        "Mês": [f"{ym % 100:02d}/{ym // 100}" for ym in tab["ym"]],
+        metrica: [fmt_metrica(v, col) for v in tab["valor"]],
+        "Δ vs Mês Anterior": [fmt_var(x, pontos) for x in tab["mom"]],
+        "Δ vs Ano Anterior": [fmt_var(x, pontos) for x in tab["yoy"]],
+    }).iloc[::-1].reset_index(drop=True)
+    return spec, tabela
+
+@st.fragment
+def secao_tendencia(empresa: str, unidades_marca: list, data_token: tuple, rollup: pd.DataFrame):
+    """Série mensal da marca (ou unidade) em todos os anos; lê só o rollup, não as linhas diárias."""
+    with PERF.section("tendência"):
+        st.markdown("---")
+        st.markdown("<div class='section-title'>📈 Tendência Mensal (Ano a Ano e Mês a Mês)</div>", unsafe_allow_html=True)
+        if not (rollup["empresa"] == empresa).any():
+            st.info("Sem coluna de data reconhecida: não há série mensal para comparar.")
+            return
+        c1, c2 = st.columns(2)
+        unidade = c1.selectbox("Escopo da tendência", options=unidades_marca, index=0, key="tend_unidade")
+        metrica = c2.selectbox("Métrica", options=list(TREND_METRICAS), index=0, key="tend_metrica")
+        spec, tabela = tendencia(rollup, data_token, empresa, unidade, metrica)
+        st.vega_lite_chart(spec, use_container_width=True)
+        st.dataframe(tabela, use_container_width=True, hide_index=True)
+
+secao_tendencia(empresa_selecionada, unidades_marca, DATA_TOKEN, SNAP.rollup)
+
+# =================== PAINEL DE PERFORMANCE (opcional) ===================
+# Liga com PERF_PANEL=true nos secrets ou ?perf=1 na URL; PERF_PROM_FILE grava as métricas no
+# formato texto do Prometheus a cada rerun; PERF_LOG ("stderr" ou arquivo) grava uma linha JSON
+# por rerun (sem ele, só se o logging "vistorias.perf" for configurado fora do app).
+PERF_LOG = str(st.secrets.get("PERF_LOG", "")).strip()
+if PERF_LOG:
+    try:
+        enable_log(PERF_LOG)
+    except OSError:
+        pass
+PERF.finish(empresa=empresa_selecionada)
+PERF_PROM_FILE = str(st.secrets.get("PERF_PROM_FILE", "")).strip()
+if PERF_PROM_FILE:
+    try:
+        METRICS.write_prometheus(PERF_PROM_FILE)
+    except OSError:
+        pass
+
+if str(st.secrets.get("PERF_PANEL", "")).strip().lower() in {"1","true","sim"} or \
+        str(st.query_params.get("perf", "")).strip().lower() in {"1","true","sim"}:
+    counters, timings = METRICS.snapshot()
+    reads, misses = counters.get("sheet_reads", 0), counters.get("sheet_cache_misses", 0)
+    with st.sidebar.expander("⏱️ Performance", expanded=True):
+        st.caption(f"Rerun: {PERF.total:.3f}s")
+        st.dataframe(pd.DataFrame(PERF.laps, columns=["Seção","Segundos"]).round(4),
+                     use_container_width=True, hide_index=True)
+        st.caption(f"API Sheets: {counters.get('sheets_api_calls', 0)} chamadas · "
+                   f"{counters.get('sheets_retries', 0)} retries · {counters.get('sheets_api_errors', 0)} erros")
+        st.caption(f"Cota: {counters.get('sheets_throttled', 0)} esperas no limitador · "
+                   f"{counters.get('sheets_breaker_trips', 0)} pausas por 429")
+        st.caption(f"Cache de planilhas: {reads - misses} hits · {misses} misses · "
+                   f"{counters.get('month_disk_cache_hits', 0)} meses do disco")
+        st.caption(f"Cauda: {counters.get('month_tail_reads', 0)} leituras · "
+                   f"{counters.get('month_tail_rows', 0)} linhas novas · "
+                   f"{counters.get('month_full_reloads', 0)} recargas completas")
+        st.dataframe(pd.DataFrame([(k, v[0], v[1] / v[0], v[2]) for k, v in sorted(timings.items())],
+                                  columns=["Seção","N","Média (s)","Máx (s)"]).round(4),
+                     use_container_width=True, hide_index=True)
@@ -0,0 +1,197 @@
+# bench.py — benchmark da carga e das interações do app usando a fonte local (sem Google Sheets)
+"""
+Gera planilhas sintéticas (índice + meses) em CSV, roda o app.py via streamlit AppTest com
+DATA_SOURCE=local e mede:
+  - carga fria (sem cache em memória nem em disco), carga quente (rerun), restart (só cache em disco)
+    e restart lendo o snapshot gravado pela CLI do engine (SNAPSHOT_FILE);
+  - custo de cada interação (slider, data, marca, heatmap, catch-up);
+  - caminho de retry (with_retry) com 429 injetados.
+
+Uso:
+    python bench.py                               # escalas 1x, 10x e 100x
+    python bench.py --escalas 1 10 --meses 12 --latencia 0.3
+    python bench.py --gerar fixtures              # só grava fixtures p/ `streamlit run` com DATA_SOURCE=local
+"""
+import argparse, calendar, csv, random, subprocess, sys, tempfile, time
+from datetime import date
+from pathlib import Path
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from perf import METRICS
+from sources import LocalSheetsSource
+
+APP = Path(__file__).with_name("app.py")
+ENGINE = APP.with_name("engine.py")
+INDEX_ID = "local-index-0000000000000000"
+
+UNIDADES = {
+    "TOKYO": ["BARRA DO CORDA", "CHAPADINHA", "SANTA INÊS", "SÃO JOÃO DOS PATOS", "SÃO JOSÉ DE RIBAMAR"],
+    "STARCHECK": ["BACABAL", "BALSAS", "CAXIAS", "CODÓ", "PINHEIRO", "SÃO LUÍS"],
+    "LOG": ["AÇAILÂNDIA", "CAROLINA", "PRESIDENTE DUTRA", "SÃO LUÍS", "TIMON"],
+    "VELOX": ["ESTREITO", "GRAJAÚ", "IMPERATRIZ", "PEDREIRAS", "SÃO LUÍS"],
+}
+COLUNAS = ["empresa", "unidade", "data_relatorio", "qtd_loja", "qtd_movel", "revistorias", "total",
+           "ticket_medio", "qtd_152", "%_152", "qtd_190", "%_190"]
+
+# =================== FIXTURES ===================
+def _write_csv(path: Path, header, rows):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(header)
+        w.writerows(rows)
+
+def _meses_ate(fim: date, n: int):
+    y, m = fim.year, fim.month
+    out = []
+    for _ in range(n):
+        out.append((y, m))
+        y, m = (y, m - 1) if m > 1 else (y - 1, 12)
+    return out[::-1]
+
+def gerar_fixtures(root, *, escala=1, meses=6, fim=None, seed=0):
+    """Grava índice (ARQUIVOS/METAS) e planilhas de mês; `escala` = linhas por unidade e dia.
+
+    O último mês fica "aberto" (até o dia de `fim`). Devolve o total de linhas geradas.
+    """
+    root = Path(root)
+    fim = fim or date.today()
+    rnd = random.Random(seed)
+    arquivos, total_linhas = [], 0
+    for y, m in _meses_ate(fim, meses):
+        key = f"local-{y}{m:02d}-000000000000000000"
+        ultimo = fim.day if (y, m) == (fim.year, fim.month) else calendar.monthrange(y, m)[1]
+        linhas = []
+        for dia in range(1, ultimo + 1):
+            d0 = date(y, m, dia)
+            if d0.weekday() == 6:
+                continue
+            for emp, unis in UNIDADES.items():
+                for uni in unis:
+                    for _ in range(escala):
+                        q152, q190 = rnd.randint(5, 60), rnd.randint(0, 30)
+                        total = q152 + q190
+                        linhas.append([emp.title(), uni.title(), d0.strftime("%d/%m/%Y"),
+                                       rnd.randint(0, total), rnd.randint(0, total), rnd.randint(0, 4), total,
+                                       rnd.randint(15000, 17000), q152, round(100 * q152 / total),
+                                       q190, round(100 * q190 / total)])
+        _write_csv(root / key / "sheet1.csv", COLUNAS, linhas)
+        total_linhas += len(linhas)
+        arquivos.append([f"https://docs.google.com/spreadsheets/d/{key}/edit", f"{m:02d}/{y}", "S"])
+    _write_csv(root / INDEX_ID / "ARQUIVOS.csv", ["URL", "MÊS", "ATIVO"], arquivos)
+    _write_csv(root / INDEX_ID / "METAS.csv", ["MÊS", "EMPRESA", "UNIDADE", "DIAS_UTEIS", "META_MENSAL"],
+               [[f"{fim.month:02d}/{fim.year}", "TOKYO", "CHAPADINHA", 22, ""]])
+    return total_linhas
+
+# =================== EXECUÇÃO DO APP ===================
+def _limpar_caches():
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+def _app(root, cache_dir, **secrets):
+    at = AppTest.from_file(str(APP), default_timeout=1800)
+    at.secrets["DATA_SOURCE"] = "local"
+    at.secrets["LOCAL_SHEETS_DIR"] = str(root)
+    at.secrets["INDEX_SHEET_ID"] = INDEX_ID
+    at.secrets["CACHE_DIR"] = str(cache_dir)
+    for k, v in secrets.items():
+        at.secrets[k] = v
+    return at
+
+def _run(at) -> float:
+    t0 = time.perf_counter()
+    at.run()
+    dt = time.perf_counter() - t0
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return dt
+
+def _selectbox(at, label):
+    return next((s for s in at.selectbox if s.label == label), None)
+
+def bench_app(root, *, latencia=0.0):
+    """Cargas fria/quente/restart e interações; devolve lista de (cenário, segundos)."""
+    out = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        _limpar_caches()
+        at = _app(root, cache_dir, LOCAL_LATENCY=latencia)
+        out.append(("carga fria", _run(at)))
+        out.append(("carga quente (rerun)", _run(at)))
+
+        _limpar_caches()
+        at = _app(root, cache_dir, LOCAL_LATENCY=latencia)
+        out.append(("restart (cache em disco)", _run(at)))
+
+        at.slider(key="dias_passados").set_value(10)
+        out.append(("slider dias passados", _run(at)))
+        interacoes = [("Data do relatório", 1, "data do relatório"),
+                      ("Selecione a Marca:", 1, "troca de marca"),
+                      ("Escopo do heatmap", 1, "escopo do heatmap"),
+                      ("Unidade", 1, "unidade do catch-up"),
+                      ("Data do relatório", 0, "volta ao mês inteiro")]
+        for label, idx, nome in interacoes:
+            sb = _selectbox(at, label)
+            if sb is None or len(sb.options) <= idx:
+                continue
+            sb.select_index(idx)
+            out.append((nome, _run(at)))
+
+        snap_file = Path(cache_dir) / "snapshot.pkl"
+        # grava pela CLI, como no cron...
+        subprocess.run([sys.executable, str(ENGINE), "--local", str(root), "--indice", INDEX_ID,
+                        "--saida", str(snap_file)], check=True, capture_output=True)
+        # e abrir em outro processo (AttributeError se as classes forem gravadas como __main__.*)
+        subprocess.run([sys.executable, "-c", "import sys, engine; engine.load_snapshot(sys.argv[1])",
+                        str(snap_file)], cwd=APP.parent, check=True, capture_output=True)
+        _limpar_caches()
+        at = _app(root, cache_dir, LOCAL_LATENCY=latencia, SNAPSHOT_FILE=str(snap_file))
+        out.append(("restart (snapshot pronto)", _run(at)))
+    return out
+
+def bench_retry(root, *, n=20, rate_limit_prob=0.3, error_prob=0.05, retry_base=0.05, cooldown=0.1):
+    """Leituras com 429/500 injetados passando pelo with_retry (limitador + circuito) da fonte local."""
+    src = LocalSheetsSource(root, rate_limit_prob=rate_limit_prob, error_prob=error_prob,
+                            seed=1, retry_base=retry_base, quota_cooldown=cooldown)
+    ok = falhas = 0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        try:
+            src.records(INDEX_ID, "ARQUIVOS")
+            ok += 1
+        except Exception:
+            falhas += 1
+    dt = time.perf_counter() - t0
+    return {"leituras": n, "ok": ok, "desistencias": falhas, "chamadas": src.calls,
+            "erros_injetados": src.failures, "pausas_429": src.breaker.trips, "seg_por_leitura": dt / n}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--escalas", type=int, nargs="+", default=[1, 10, 100], help="linhas por unidade/dia")
+    ap.add_argument("--meses", type=int, default=6)
+    ap.add_argument("--latencia", type=float, default=0.0, help="latência simulada por chamada (s)")
+    ap.add_argument("--gerar", metavar="DIR", help="grava as fixtures (1ª escala) em DIR e sai")
+    args = ap.parse_args(argv)
+
+    if args.gerar:
+        linhas = gerar_fixtures(args.gerar, escala=args.escalas[0], meses=args.meses)
+        print(f"{linhas} linhas gravadas em {args.gerar} (INDEX_SHEET_ID={INDEX_ID})")
+        return
+
+    for escala in args.escalas:
+        with tempfile.TemporaryDirectory() as root:
+            linhas = gerar_fixtures(root, escala=escala, meses=args.meses)
+            print(f"\n== {escala}x — {linhas} linhas em {args.meses} meses ==")
+            METRICS.reset()
+            for nome, seg in bench_app(root, latencia=args.latencia):
+                print(f"  {nome:<28} {seg:8.3f}s")
+            _, timings = METRICS.snapshot()
+            print("  seções (média): " + ", ".join(f"{k}={v[1] / v[0]:.3f}s" for k, v in sorted(timings.items())))
+            if escala == args.escalas[0]:
+                r = bench_retry(root)
+                print("  retry: " + ", ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}"
+                                              for k, v in r.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1017 @@
+# engine.py — cálculo do painel sem Streamlit: ingestão, snapshot, visões e CLI que grava o snapshot
+"""
+Monta o snapshot do painel (histórico, metas, cubo diário e recortes por marca × mês/dia × unidade)
+fora do navegador e grava um artefato versionado que o app carrega com SNAPSHOT_FILE nos secrets.
+
+Uso:
+    python engine.py --saida snapshot.pkl                     # Google Sheets (.streamlit/secrets.toml)
+    python engine.py --saida snapshot.pkl --local fixtures --indice local-index-0000000000000000
+                                                              # CSVs da fonte local (bench.py --gerar)
+    python engine.py --saida snapshot.pkl --arquivos /mnt/export --indice indice.xlsx   # .xlsx/.csv/Parquet
+    python engine.py --saida snapshot.pkl --cache-dir .cache/vistorias   # reaproveita meses em Parquet
+
+Pensado para cron: grava com troca atômica e, se alguma planilha falhar, não substitui o
+artefato anterior (a menos que se passe --parcial).
+"""
+import argparse, calendar, os, pickle, re, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, date
+from pathlib import Path
+
+import pandas as pd
+import numpy as np
+
+from perf import METRICS
+from sources import FILE_EXTS, error_status
+
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.options.mode.copy_on_write = True  # recortes sem cópia (padrão a partir do pandas 3)
+
+# ================= CONEXÃO GOOGLE SHEETS =================
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+def authorize(creds_dict):
+    """Cliente gspread a partir do service account (dict do secrets)."""
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+    # (se quiser migrar depois: from google.oauth2.service_account import Credentials)
+    # oauth2client (como já usa hoje):
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(dict(creds_dict), SCOPE)
+    # Se migrar futuramente:
+    # creds = Credentials.from_service_account_info(creds_dict, scopes=SCOPE)
+    return gspread.authorize(creds)
+
+# ====== PLANILHA-ÍNDICE ======
+INDEX_SHEET_ID  = "1L55P-vJifVEg6BHBGVLd00m3AXsz7hEyCPMA60G6Jms"  # padrão; o app aceita INDEX_SHEET_ID nos secrets
+INDEX_TAB_ARQS  = "ARQUIVOS"   # colunas: URL | MÊS | ATIVO
+INDEX_TAB_METAS = "METAS"      # colunas: MÊS | EMPRESA | UNIDADE | DIAS_UTEIS | META_MENSAL
+
+# =================== HELPERS ===================
+ID_RE = re.compile(r"/d/([a-zA-Z0-9-_]+)")
+def _sheet_id(s: str):
+    s = (s or "").strip()
+    if s.lower().endswith(FILE_EXTS):
+        return s  # fonte de arquivos: o "ID" é o caminho do arquivo
+    m = ID_RE.search(s)
+    if m: return m.group(1)
+    if re.fullmatch(r"[A-Za-z0-9-_]{20,}", s): return s
+    if re.search(r"[/\\]", s) and "://" not in s:
+        return s.rstrip("/\\")  # fonte de arquivos: pasta com um arquivo por aba
+    return None
+
+def _ym_token(x):
+    if isinstance(x, (date, datetime)):  # célula de data num .xlsx
+        return f"{x.year}-{x.month:02d}"
+    s = str(x).strip()
+    if re.fullmatch(r"\d{2}/\d{4}", s):
+        mm, yy = s.split("/")
+        return f"{yy}-{int(mm):02d}"
+    if re.fullmatch(r"\d{4}-\d{2}", s):
+        return s
+    return None
+
+DATE_FORMATS = ("%d/%m/%Y","%Y-%m-%d","%d-%m-%Y")
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+# seriais do Excel que cabem no datetime64[ns]; fora disso (ex.: 20260101) a célula vira texto
+EXCEL_SERIAL_RANGE = ((pd.Timestamp("1677-09-22") - EXCEL_EPOCH).days, (pd.Timestamp("2262-04-10") - EXCEL_EPOCH).days)
+
+def parse_date_series(s: pd.Series) -> pd.Series:
+    """Datas do relatório como datetime64 no dia.
+
+    Números são seriais do Excel (floats sem truncar o dia); os fora do intervalo e os textos
+    passam por DATE_FORMATS e, por último, pelo pd.to_datetime elemento a elemento (NaT se falhar).
+    """
+    out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        is_num = s.notna()
+    else:
+        is_num = s.map(lambda x: isinstance(x, (int, float, np.number)) and not isinstance(x, (bool, np.bool_)))
+        is_num &= s.notna()
+    if is_num.any():
+        serial = pd.to_numeric(s[is_num], errors="coerce")
+        valido = serial.between(*EXCEL_SERIAL_RANGE)
+        out[valido[valido].index] = (EXCEL_EPOCH + pd.to_timedelta(serial[valido], unit="D")).dt.floor("D")
+        is_num.loc[serial.index] = valido  # fora do intervalo: tenta como texto
+
+    txt = s[~is_num & s.notna()].astype(str).str.strip()
+    txt = txt[txt != ""]
+    for fmt in DATE_FORMATS:
+        if txt.empty:
+            break
+        parsed = pd.to_datetime(txt, format=fmt, errors="coerce")
+        ok = parsed.notna()
+        out[ok[ok].index] = parsed[ok]
+        txt = txt[~ok]
+    if not txt.empty:  # último recurso, elemento a elemento (como pd.to_datetime(s))
+        out[txt.index] = pd.to_datetime(txt, format="mixed", errors="coerce").dt.floor("D")
+    return out
+
+def safe_div(a,b): return (a/b) if b else 0
+def round_list(values, nd=1):
+    """round() do Python elemento a elemento (np.round diverge em casos como 358.85 -> 358.8)."""
+    return [round(float(v), nd) for v in values]
+def is_workday(d: date) -> bool: return isinstance(d, date) and d.weekday() < 5
+
+# =================== METAS BASE (21 dias) ===================
+metas_unidades_base = {
+    "TOKYO": {"BARRA DO CORDA": 677, "CHAPADINHA": 573, "SANTA INÊS": 2291, "SÃO JOÃO DOS PATOS": 453, "SÃO JOSÉ DE RIBAMAR": 2083},
+    "STARCHECK": {"BACABAL": 1658, "BALSAS": 1642, "CAXIAS": 604, "CODÓ": 446, "PINHEIRO": 917, "SÃO LUÍS": 3272},
+    "LOG": {"AÇAILÂNDIA": 1185, "CAROLINA": 126, "PRESIDENTE DUTRA": 926, "SÃO LUÍS": 4455, "TIMON": 896},
+    "VELOX": {"ESTREITO": 482, "GRAJAÚ": 496, "IMPERATRIZ": 3488, "PEDREIRAS": 625, "SÃO LUÍS": 1926}
+}
+if "VELOX" in metas_unidades_base and "SÃO LÍS" in metas_unidades_base["VELOX"]:
+    metas_unidades_base["VELOX"]["SÃO LUÍS"] = metas_unidades_base["VELOX"].pop("SÃO LÍS")
+BASE_21 = 21
+
+# =================== ÍNDICE E PLANILHAS DE MÊS ===================
+class IngestError(Exception):
+    """Falha que impede montar o snapshot; a mensagem vai direto para o st.error."""
+
+ATIVO_SIM = {"S","SIM","Y","YES","TRUE","1"}
+
+def active_files(rows_arqs: list) -> list:
+    """Linhas ativas da aba ARQUIVOS (IngestError se nenhuma)."""
+    ativos = [r for r in rows_arqs if str(r.get("ATIVO","S")).strip().upper() in ATIVO_SIM]
+    if len(ativos) == 0:
+        raise IngestError("Planilha-índice vazia (aba ARQUIVOS).")
+    return ativos
+
+# colunas que o painel usa; o resto da planilha é descartado na ingestão
+COLS_CONTADORES = ["total","revistorias","qtd_152","qtd_190"]
+COLS_USADAS = ["empresa","unidade","__data__","__ym__"] + COLS_CONTADORES + ["%_190"]
+DATE_COLS = ["data_relatorio","DATA","Data","data"]  # candidatas, em ordem de preferência
+# o que se pede à planilha de mês (só estas colunas trafegam)
+MONTH_COLS = ("empresa", "unidade", *DATE_COLS, *COLS_CONTADORES, "%_190")
+
+def normalize_month_frame(data_cols, ym):
+    """Padroniza as colunas ({nome: valores}) ou registros de uma planilha de mês (None se vazia)."""
+    data = pd.DataFrame(data_cols)
+    if data.empty:
+        return None
+
+    # padronização básica
+    data.columns = [c.strip() for c in data.columns]
+    if "empresa" in data.columns:
+        data["empresa"] = (data["empresa"].astype(str).str.upper().str.strip().str.replace(r"\s+"," ",regex=True))
+    if "unidade" in data.columns:
+        data["unidade"] = (data["unidade"].astype(str).str.upper().str.strip().str.replace(r"\s+"," ",regex=True))
+
+    # data
+    date_candidates = [c for c in DATE_COLS if c in data.columns]
+    date_col = date_candidates[0] if date_candidates else None
+    data["__data__"] = parse_date_series(data[date_col]) if date_col else pd.Series(pd.NaT, index=data.index, dtype="datetime64[ns]")
+
+    # deduz YM se faltar
+    if ym is None and data["__data__"].notna().any():
+        d = data["__data__"].max()
+        ym = f"{d.year}-{d.month:02d}"
+    data["__ym__"] = ym
+
+    # números (contadores em int32, %_190 em float32)
+    for col in COLS_CONTADORES + ["%_190"]:
+        if col not in data.columns:
+            data[col] = 0
+        data[col] = pd.to_numeric(data[col], errors="coerce").fillna(0)
+    data = data[[c for c in COLS_USADAS if c in data.columns]]
+    return data.astype({**{c: "int32" for c in COLS_CONTADORES}, "%_190": "float32"})
+
+# --- Cache em disco (Parquet) dos meses já normalizados, por planilha + revisão ---
+CACHE_VERSION = "v3"  # incrementar quando a normalização mudar
+
+def _cache_name(sheet_key: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_-]", "_", sheet_key)  # caminhos da fonte de arquivos viram nome plano
+
+def _month_cache_path(cache_dir: Path, sheet_key: str, revision: str) -> Path:
+    rev = re.sub(r"[^0-9A-Za-z]", "", revision)
+    return Path(cache_dir) / f"{_cache_name(sheet_key)}__{CACHE_VERSION}_{rev}.parquet"
+
+def read_month_cache(cache_dir, sheet_key: str, revision: str | None):
+    if not revision or cache_dir is None:
+        return None
+    path = _month_cache_path(cache_dir, sheet_key, revision)
+    if not path.exists():
+        return None
+    try:
+        return pd.read_parquet(path, memory_map=True)
+    except Exception:
+        return None
+
+def write_month_cache(cache_dir, sheet_key: str, revision: str | None, data: pd.DataFrame):
+    """Grava o mês normalizado e remove revisões antigas da mesma planilha (fail-soft)."""
+    if not revision or cache_dir is None:
+        return
+    path = _month_cache_path(cache_dir, sheet_key, revision)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        data.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        for old in path.parent.glob(f"{_cache_name(sheet_key)}__*.parquet"):
+            if old != path:
+                old.unlink(missing_ok=True)
+    except Exception:
+        pass
+
+def load_months(ativos, load, max_workers=4):
+    """Aplica `load` a cada linha ativa em paralelo; devolve ([(sheet_id, df)] na ordem do índice, falhas)."""
+    dfs, falhas = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futs = [ex.submit(load, r) for r in ativos]
+        for r, fut in zip(ativos, futs):
+            try:
+                data = fut.result()
+            except Exception as e:
+                falhas.append((r.get("MÊS") or r.get("MES") or "?", str(e)))
+                continue  # segue o loop
+            if data is not None:
+                dfs.append((_sheet_id(r.get("URL","")), data))
+    return dfs, falhas
+
+def data_key(index_id: str, ativos, revision, max_workers=4) -> tuple:
+    """Versão dos dados: revisão do índice (ARQUIVOS/METAS) + de cada planilha ativa.
+
+    `revision(sheet_id)` devolve o modifiedTime (ou None); sem ele, usa a janela de 10 min
+    do cache como versão.
+    """
+    sids = [_sheet_id(r.get("URL","")) for r in ativos]
+    sids = [index_id] + [sid for sid in sids if sid]
+    with ThreadPoolExecutor(max_workers=max_workers) as ex:
+        revs = list(ex.map(revision, sids))
+    ttl = f"ttl-{int(time.time() // 600)}"
+    return tuple((sid, rev or ttl) for sid, rev in zip(sids, revs))
+
+# =================== TABELA DE METAS RESOLVIDAS ===================
+def build_goals_table(metas_rows: list) -> pd.DataFrame:
+    """Metas efetivas: uma linha por (ym, empresa, unidade) com dias_uteis, meta_mensal e meta_dia.
+
+    Combina a base de 21 dias com a aba METAS (META_MENSAL manda; senão a base é escalada por
+    DIAS_UTEIS). O bloco ym == "" traz a base pura, usada para meses sem linha na aba.
+    """
+    over = []
+    for r in metas_rows:
+        ym = _ym_token(r.get("MÊS") or r.get("MES"))
+        emp = str(r.get("EMPRESA","")).strip().upper()
+        uni = str(r.get("UNIDADE","")).strip().upper()
+        if not ym or not emp or not uni:
+            continue
+        du  = r.get("DIAS_UTEIS", "")
+        mm  = r.get("META_MENSAL", "")
+        try: du = int(du) if str(du).strip() != "" else None
+        except: du = None
+        try: mm = int(mm) if str(mm).strip() != "" else None
+        except: mm = None
+        over.append((ym, emp, uni, du, mm))
+    over = (pd.DataFrame(over, columns=["ym","empresa","unidade","du","mm"])
+              .astype({"du": "float64", "mm": "float64"})
+              .drop_duplicates(["ym","empresa","unidade"], keep="last"))
+
+    base = pd.DataFrame([(emp, uni, meta) for emp, unis in metas_unidades_base.items() for uni, meta in unis.items()],
+                        columns=["empresa","unidade","meta_base"])
+    base["na_base"] = True
+    yms = pd.DataFrame({"ym": [""] + sorted(over["ym"].unique().tolist())})
+    g = base.merge(yms, how="cross").merge(over, on=["ym","empresa","unidade"], how="outer")
+    g["meta_base"] = g["meta_base"].fillna(0)
+    g["na_base"] = g["na_base"].fillna(False).astype(bool)
+
+    escala = g["du"].fillna(BASE_21) / BASE_21
+    g["meta_mensal"] = np.where(g["mm"].notna(), g["mm"], np.round(g["meta_base"] * escala)).astype(int)
+    g["dias_uteis"] = np.where(g["du"].fillna(0) != 0, g["du"], BASE_21).astype(int)
+    g["meta_dia"] = g["meta_mensal"] / g["dias_uteis"]
+    return g[["ym","empresa","unidade","dias_uteis","meta_mensal","meta_dia","na_base"]]
+
+def goals_mes(goals: pd.DataFrame, ym: str) -> pd.DataFrame:
+    """Metas resolvidas do mês (base de 21 dias se o mês não estiver na aba METAS)."""
+    sel = goals["ym"] == ym
+    return goals[sel] if sel.any() else goals[goals["ym"] == ""]
+
+# =================== FUNÇÕES DE META (usam a tabela resolvida) ===================
+def metas_unidades_df(goals: pd.DataFrame, empresa: str, ym: str, unidades) -> pd.DataFrame:
+    """Meta mensal e dias úteis por unidade, alinhados à ordem de `unidades` (join com as metas)."""
+    g = goals_mes(goals, ym)
+    g = g.loc[g["empresa"] == empresa, ["unidade","meta_mensal","dias_uteis"]]
+    out = pd.DataFrame({"unidade": list(unidades)}).merge(g, on="unidade", how="left")
+    out["meta_mes"] = out["meta_mensal"].fillna(0).astype(int)
+    out["du"] = out["dias_uteis"].fillna(BASE_21).astype(int)
+    return out[["unidade","meta_mes","du"]]
+
+def meta_unidade_mes(goals: pd.DataFrame, empresa: str, unidade: str, ym: str) -> int:
+    return int(metas_unidades_df(goals, empresa, ym, [unidade])["meta_mes"].iloc[0])
+
+def dias_uteis_unidade(goals: pd.DataFrame, empresa: str, unidade: str, ym: str) -> int:
+    return int(metas_unidades_df(goals, empresa, ym, [unidade])["du"].iloc[0])
+
+def metas_marcas_mes(goals: pd.DataFrame, ym: str) -> pd.Series:
+    """Meta do mês por marca (soma das unidades da base)."""
+    g = goals_mes(goals, ym)
+    return g[g["na_base"]].groupby("empresa")["meta_mensal"].sum()
+
+def meta_marca_mes(goals: pd.DataFrame, empresa: str, ym: str) -> int:
+    return int(metas_marcas_mes(goals, ym).get(empresa, 0))
+
+# =================== HISTÓRICO COMPLETO ===================
+# df_full vem ordenado por (empresa, data) e com colunas de calendário pré-calculadas:
+# recortes por marca/período viram fatias contíguas ou comparações vetorizadas.
+def rows_periodo(frame: pd.DataFrame, inicio, fim) -> pd.DataFrame:
+    """Linhas com inicio <= __data__ <= fim, por busca binária (frame ordenado por data)."""
+    d = frame["__data__"].to_numpy()
+    i = np.searchsorted(d, pd.Timestamp(inicio).to_datetime64(), side="left")
+    j = np.searchsorted(d, pd.Timestamp(fim).to_datetime64(), side="right")
+    return frame.iloc[i:j]
+
+def ym_int(year: int, month: int) -> int:
+    return year * 100 + month
+
+# =================== CUBO DIÁRIO (empresa × unidade × dia) ===================
+CUBE_SUMS = dict(total=("total","sum"), rev=("rev","sum"), qtd152=("qtd152","sum"), qtd190=("qtd190","sum"),
+                 pct190_sum=("pct190_sum","sum"), pct190_n=("pct190_n","sum"))
+
+def build_daily_cube(df_full: pd.DataFrame) -> pd.DataFrame:
+    """Agregado diário usado por todas as seções (montado uma vez por snapshot)."""
+    cube = (df_full.groupby(["empresa","unidade","__data__"], dropna=False, observed=True)
+               .agg(total=("total","sum"), rev=("revistorias","sum"),
+                    qtd152=("qtd_152","sum"), qtd190=("qtd_190","sum"),
+                    pct190_sum=("%_190","sum"), pct190_n=("%_190","size"))
+               .reset_index()
+               .astype({"empresa": object, "unidade": object})
+               .sort_values(["empresa","__data__","unidade"], kind="stable")
+               .reset_index(drop=True))
+    cube["liq"] = cube["total"] - cube["rev"]
+    _cdt = cube["__data__"].dt
+    cube["ym"] = (_cdt.year.fillna(0) * 100 + _cdt.month.fillna(0)).astype("int32")
+    cube["is_workday"] = (_cdt.weekday < 5) & cube["__data__"].notna()
+    return cube
+
+def cube_sum(frame: pd.DataFrame, by) -> pd.DataFrame:
+    """Reagrega um recorte do cubo por `by` (liq e média do %_190 recompostos)."""
+    g = frame.groupby(by, dropna=False, as_index=False).agg(**CUBE_SUMS)
+    g["liq"] = g["total"] - g["rev"]
+    g["pct190"] = g["pct190_sum"] / g["pct190_n"]
+    return g
+
+def unit_daily_with_prev(cube: pd.DataFrame) -> pd.DataFrame:
+    """Líquido por (empresa, unidade, dia) com o último dia útil anterior que teve dado (liq_prev)."""
+    d = (cube.dropna(subset=["unidade","__data__"])
+              [["empresa","unidade","__data__","is_workday","liq"]]
+              .astype({"liq": int})
+              .sort_values("__data__", kind="stable"))
+    prev = (d[d["is_workday"]][["empresa","unidade","__data__","liq"]]
+            .rename(columns={"liq": "liq_prev"}))
+    prev["__data_prev__"] = prev["__data__"]
+    d = pd.merge_asof(d, prev, on="__data__", by=["empresa","unidade"], allow_exact_matches=False)
+    return d.sort_values(["empresa","__data__","unidade"], kind="stable").reset_index(drop=True)
+
+# =================== PARTIÇÕES POR MARCA ===================
+@dataclass(frozen=True)
+class BrandPartition:
+    """Recortes e somas de uma marca, montados junto com o snapshot (trocar de marca = lookup)."""
+    rows: slice          # linhas da marca em df_full (contíguas, ordenadas por data)
+    cube: pd.DataFrame   # cubo da marca, ordenado por data
+    unidades: list
+    yms: list            # meses AAAAMM com data
+    last_date: object    # pd.Timestamp (NaT sem datas)
+    ym_token: dict       # AAAAMM -> último __ym__ das linhas do mês; None -> da marca toda
+    por_mes: dict        # AAAAMM (None = tudo) -> soma por unidade (fatia; índice não zerado)
+    por_dia: dict        # data -> soma por unidade + liq_mtd (acumulado do mês até o dia)
+
+def _blocos(frame: pd.DataFrame, col: str) -> dict:
+    """{valor: fatia} de um frame ordenado por `col` (blocos contíguos, sem cópia)."""
+    v = frame[col].to_numpy()
+    chaves, ini = np.unique(v, return_index=True)
+    fim = np.append(ini[1:], len(v))
+    return {k: frame.iloc[i:j] for k, i, j in zip(pd.Index(chaves), ini, fim)}
+
+def build_brand_partitions(df_full: pd.DataFrame, cube: pd.DataFrame) -> dict:
+    """{empresa: BrandPartition}; df_full e cubo já vêm ordenados por empresa e data.
+
+    As somas são feitas uma vez para todas as marcas e fatiadas por blocos contíguos.
+    """
+    cube_data = cube[cube["__data__"].notna()]
+    mes = _blocos(cube_sum(cube_data, ["empresa","ym","unidade"]), "empresa")
+    tudo = _blocos(cube_sum(cube, ["empresa","unidade"]), "empresa")
+    dia = cube_data.assign(pct190=cube_data["pct190_sum"] / cube_data["pct190_n"])
+    dia["liq_mtd"] = dia.groupby(["empresa","ym","unidade"], dropna=False)["liq"].cumsum().astype(int)
+    dia = _blocos(dia, "empresa")
+    cubo = _blocos(cube, "empresa")
+
+    parts = {}
+    for emp, pos in df_full.groupby("empresa", sort=False, observed=True).indices.items():
+        rows = slice(int(pos[0]), int(pos[-1]) + 1)
+        d = df_full.iloc[rows]
+        com_data = d["__data__"].notna()
+        toks = d["__ym__"].astype(object)
+        ym_token = toks[com_data].groupby(d.loc[com_data, "ym"]).last().dropna().to_dict()
+        ym_token[None] = toks.dropna().iloc[-1] if toks.notna().any() else None
+
+        por_mes = _blocos(mes[emp], "ym") if emp in mes else {}
+        por_mes[None] = tudo[emp]  # toda marca de df_full tem linhas no cubo
+        parts[emp] = BrandPartition(
+            rows=rows, cube=cubo[emp],
+            unidades=sorted(d["unidade"].dropna().unique().tolist()),
+            yms=sorted(d.loc[com_data, "ym"].unique().tolist()),
+            last_date=d["__data__"].max(),
+            ym_token=ym_token, por_mes=por_mes,
+            por_dia=_blocos(dia[emp], "__data__") if emp in dia else {},
+        )
+    return parts
+
+# =================== ROLLUP MENSAL (empresa × unidade × mês) ===================
+ROLLUP_SUMS = ["total","rev","qtd152","qtd190","pct190_sum","pct190_n"]
+
+def _rollup_sums(cube: pd.DataFrame, meses=None) -> pd.DataFrame:
+    c = cube[cube["ym"] > 0] if meses is None else cube[cube["ym"].isin(list(meses))]
+    return c.groupby(["empresa","unidade","ym"], dropna=False, as_index=False)[ROLLUP_SUMS].sum()
+
+def _ym_tokens(yms) -> pd.Series:
+    yms = pd.Series(yms)
+    return (yms // 100).astype(str) + "-" + (yms % 100).astype(str).str.zfill(2)
+
+def _rollup_metricas(r: pd.DataFrame) -> pd.DataFrame:
+    """Líquido, %_190 médio, ticket do mix e atingimento (precisa de meta_mes)."""
+    r["liq"] = r["total"] - r["rev"]
+    r["pct190"] = r["pct190_sum"] / r["pct190_n"]
+    r["ticket"] = calc_ticket(r["qtd152"], r["qtd190"])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r["atingimento"] = np.where(r["meta_mes"] > 0, r["liq"] / r["meta_mes"] * 100, np.nan)
+    return r
+
+def build_monthly_rollup(cube: pd.DataFrame, goals: pd.DataFrame, anterior=None, recalcular=None) -> pd.DataFrame:
+    """Uma linha por (empresa, unidade, mês AAAAMM) com as somas do cubo, meta e atingimento.
+
+    Com `anterior` (rollup do snapshot anterior), os meses fora de `recalcular` vêm congelados
+    de lá e só os demais (os alterados e os novos) são reagrupados. A meta é juntada sempre de
+    novo, porque a aba METAS pode mudar sem mexer nos meses.
+    """
+    if anterior is None or recalcular is None:
+        sums = _rollup_sums(cube)
+    else:
+        meses = set(cube.loc[cube["ym"] > 0, "ym"].unique().tolist())
+        congelados = anterior[anterior["ym"].isin(list(meses - set(recalcular)))]
+        refazer = meses - set(congelados["ym"].unique().tolist())
+        METRICS.inc("rollup_frozen_months", len(meses) - len(refazer))
+        sums = pd.concat([congelados[["empresa","unidade","ym",*ROLLUP_SUMS]], _rollup_sums(cube, refazer)],
+                         ignore_index=True)
+    sums = sums.sort_values(["empresa","unidade","ym"], kind="stable").reset_index(drop=True)
+
+    tok = _ym_tokens(sums["ym"])
+    tok = tok.where(tok.isin(set(goals["ym"])), "")  # mês fora da aba METAS -> base de 21 dias
+    g = goals[["ym","empresa","unidade","meta_mensal"]].rename(columns={"ym": "_gym"})
+    r = sums.assign(_gym=tok.to_numpy()).merge(g, on=["_gym","empresa","unidade"], how="left")
+    r["meta_mes"] = r.pop("meta_mensal").fillna(0).astype(int)
+    return _rollup_metricas(r.drop(columns="_gym"))
+
+# =================== SNAPSHOT ===================
+UNIDADE_MERGE_MAP = {"RIACHÃO":"BALSAS","RIACHAO":"BALSAS"}
+
+@dataclass(frozen=True)
+class DataSnapshot:
+    """Tudo o que depende só dos dados (não da sessão). Compartilhado: não alterar in-place."""
+    df_full: pd.DataFrame
+    brands: dict         # empresa -> BrandPartition
+    yms: list            # meses AAAAMM com data (todas as marcas)
+    dias_mes: dict       # AAAAMM -> datas com dado, ordenadas
+    cube: pd.DataFrame
+    unit_daily: pd.DataFrame
+    goals: pd.DataFrame
+    rollup: pd.DataFrame  # empresa × unidade × mês (ver build_monthly_rollup)
+    sheet_months: dict    # sheet_id -> meses AAAAMM com linhas na planilha (rollup incremental)
+    falhas: list
+    token: tuple
+    built_at: datetime
+
+def _sheet_months(dfs: list) -> dict:
+    meses = {}
+    for sid, df in dfs:
+        d = df["__data__"].dropna()
+        meses.setdefault(sid, set()).update((d.dt.year * 100 + d.dt.month).unique().tolist())
+    return meses
+
+def _meses_recalcular(sheet_months: dict, falhas: list, key: tuple, anterior) -> set | None:
+    """Meses AAAAMM que o rollup precisa refazer (None = todos).
+
+    Reaproveita o rollup anterior só se o conjunto de planilhas é o mesmo e nenhuma falhou
+    agora ou antes; aí refaz os meses que as planilhas com revisão nova têm agora ou tinham
+    antes (no dia a dia, só o mês aberto).
+    """
+    if anterior is None or falhas or anterior.falhas:
+        return None
+    revs, revs_ant = dict(key[1:]), dict(anterior.token[1:])
+    if set(revs) != set(revs_ant) or set(sheet_months) != set(anterior.sheet_months):
+        return None
+    meses = set()
+    for sid, rev in revs.items():
+        if rev != revs_ant.get(sid):
+            meses |= sheet_months.get(sid, set()) | anterior.sheet_months.get(sid, set())
+    return meses
+
+def assemble_snapshot(dfs: list, falhas: list, metas_rows: list, key: tuple, anterior=None) -> DataSnapshot:
+    """Meses normalizados ([(sheet_id, df)]) + aba METAS → histórico, metas, cubo, partições e rollup.
+
+    `anterior` (snapshot anterior) deixa o rollup mensal reaproveitar os meses fechados.
+    """
+    if not dfs:
+        raise IngestError("Nenhuma planilha de mês pôde ser lida.")
+    sheet_months = _sheet_months(dfs)
+    recalcular = _meses_recalcular(sheet_months, falhas, key, anterior)
+
+    with METRICS.timed("snapshot: histórico"):
+        df = pd.concat([d for _, d in dfs], ignore_index=True)
+        del dfs
+        # 👉 Merge: RIACHÃO → BALSAS
+        if "unidade" in df.columns:
+            df["unidade"] = df["unidade"].replace(UNIDADE_MERGE_MAP)
+        # textos repetidos em categorias (após o concat, para as categorias serem únicas)
+        df = df.astype({c: "category" for c in ["empresa","unidade","__ym__"] if c in df.columns})
+
+        df_full = df.sort_values(["empresa","__data__"], kind="stable").reset_index(drop=True)
+        del df
+        _dt = df_full["__data__"].dt
+        df_full["year"] = _dt.year.fillna(0).astype("int16")
+        df_full["month"] = _dt.month.fillna(0).astype("int8")
+        df_full["ym"] = df_full["year"].astype("int32") * 100 + df_full["month"]
+        df_full["is_workday"] = (_dt.weekday < 5) & df_full["__data__"].notna()
+        dias = df_full.loc[df_full["__data__"].notna(), ["ym","__data__"]].drop_duplicates().sort_values("__data__")
+        dias_mes = {ym: g.tolist() for ym, g in dias.groupby("ym")["__data__"]}
+
+    with METRICS.timed("snapshot: metas"):
+        goals = build_goals_table(metas_rows)
+
+    with METRICS.timed("snapshot: cubo"):
+        cube = build_daily_cube(df_full)
+        unit_daily = unit_daily_with_prev(cube)
+
+    with METRICS.timed("snapshot: marcas"):
+        brands = build_brand_partitions(df_full, cube)
+
+    with METRICS.timed("snapshot: rollup"):
+        rollup = build_monthly_rollup(cube, goals, anterior.rollup if recalcular is not None else None,
+                                      recalcular)
+    return DataSnapshot(df_full=df_full, brands=brands, yms=sorted(dias_mes), dias_mes=dias_mes,
+                        cube=cube, unit_daily=unit_daily, goals=goals, rollup=rollup,
+                        sheet_months=sheet_months, falhas=falhas, token=key, built_at=datetime.now())
+
+# --- Ingestão (app e CLI): `read(sheet_key, query)` busca; o app injeta o seu, com cache ---
+MONTH_QUERY = ("cols", *MONTH_COLS)  # só as colunas usadas trafegam
+
+def fetch(source, sheet_key: str, query: tuple):
+    """`("tabs", aba, ...)` → registros de cada aba num só batchGet;
+    `("cols", nome, ...)` → {coluna: valores} da 1ª aba, só com as colunas pedidas;
+    `("tail", linha, nome, ...)` → idem, só da `linha` da planilha em diante."""
+    kind, *args = query
+    if kind == "cols":
+        return source.columns(sheet_key, args)
+    if kind == "tail":
+        return source.columns(sheet_key, args[1:], start_row=args[0])
+    return source.batch_records(sheet_key, args)
+
+def read_index(read, index_id: str = INDEX_SHEET_ID) -> tuple[list, list]:
+    """(ARQUIVOS, METAS) num só batchGet; sem a aba METAS (400), lê só ARQUIVOS e segue sem overrides.
+
+    Outros erros (429/5xx que sobraram dos retries etc.) sobem: o snapshot não pode sair com as
+    metas base achando que a aba não existe.
+    """
+    try:
+        arqs, metas = read(index_id, ("tabs", INDEX_TAB_ARQS, INDEX_TAB_METAS))
+    except Exception as e:
+        if error_status(e) != 400:
+            raise
+        arqs, metas = read(index_id, ("tabs", INDEX_TAB_ARQS))[0], []
+    return arqs, metas
+
+def load_month(read, r, *, revision=None, cache_dir=None, tail=None, on_full=None):
+    """Lê e padroniza uma planilha de mês listada em ARQUIVOS (None se vazia ou sem URL).
+
+    `revision(sheet_id)` liga o cache em disco (Parquet) em `cache_dir`. `tail(sheet_id, ym, rev)`
+    devolve o mês montado só com as linhas novas, ou None para ler tudo; esse frame é
+    provisório e não vai ao disco. `on_full(sheet_id, cols, data, rev)` vê cada leitura completa
+    (`rev` é a revisão lida antes da busca, ou None).
+    """
+    sid = _sheet_id(r.get("URL",""))
+    ym  = _ym_token(r.get("MÊS") or r.get("MES"))
+    if not sid:
+        url = str(r.get("URL","")).strip()
+        if url:  # vai para as falhas do snapshot em vez de sumir em silêncio
+            raise IngestError(f"URL não reconhecida na aba ARQUIVOS: {url}")
+        return None
+    rev = revision(sid) if revision is not None else None
+    data = read_month_cache(cache_dir, sid, rev)
+    if data is not None:
+        METRICS.inc("month_disk_cache_hits")
+        return data
+    data = tail(sid, ym, rev) if tail is not None else None
+    if data is not None:
+        return data
+    with METRICS.timed("fetch planilha"):
+        cols = read(sid, MONTH_QUERY)  # sheet1, só as colunas usadas
+    with METRICS.timed("normalização"):
+        data = normalize_month_frame(cols, ym)
+    if data is not None:
+        if on_full is not None:
+            on_full(sid, cols, data, rev)
+        write_month_cache(cache_dir, sid, rev, data)
+    return data
+
+def build_snapshot(source, index_id: str = INDEX_SHEET_ID, *, cache_dir=None, max_workers=4,
+                   anterior=None) -> DataSnapshot:
+    """Ingestão completa direto de uma fonte (Google / local / arquivos), sem os caches do app."""
+    def read(sheet_key, query):
+        return fetch(source, sheet_key, query)
+    try:
+        arqs, metas = read_index(read, index_id)
+    except Exception as e:
+        raise IngestError(f"Não foi possível ler a aba ARQUIVOS do índice. Erro: {e}") from e
+    ativos = active_files(arqs)
+    key = data_key(index_id, ativos, source.revision, max_workers)
+    with METRICS.timed("snapshot: planilhas"):
+        revision = source.revision if cache_dir is not None else None
+        dfs, falhas = load_months(ativos, lambda r: load_month(read, r, revision=revision,
+                                                               cache_dir=cache_dir), max_workers)
+    return assemble_snapshot(dfs, falhas, metas, key, anterior)
+
+# --- Artefato versionado (pickle): o app lê com load_snapshot ---
+SNAPSHOT_VERSION = 2  # incrementar quando DataSnapshot/BrandPartition ou os cálculos mudarem
+
+def save_snapshot(snap: DataSnapshot, path):
+    """Grava o snapshot com cabeçalho de versão (troca atômica, leitores nunca veem arquivo pela metade)."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump({"version": SNAPSHOT_VERSION, "pandas": pd.__version__, "snapshot": snap},
+                    f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+def load_snapshot(path) -> DataSnapshot:
+    """Lê um artefato de save_snapshot (ValueError se for de outra versão)."""
+    with open(path, "rb") as f:
+        art = pickle.load(f)
+    if not isinstance(art, dict) or art.get("version") != SNAPSHOT_VERSION:
+        versao = art.get("version") if isinstance(art, dict) else "?"
+        raise ValueError(f"Snapshot {path} na versão {versao}; esperada {SNAPSHOT_VERSION}.")
+    return art["snapshot"]
+
+# =================== VISÕES (cards, tabela, calendário, catch-up, ranking) ===================
+CONSOLIDADO = "(Consolidado da Marca)"
+
+def fmt_tendencia(t):
+    return f"{t:.0f}% {'🚀' if t >= 100 else '😟'}"
+
+# --- Projeção do mês: grade what-if dos sliders de dias úteis ---
+GRID_DIAS_TOTAL = np.arange(1, 32)     # slider "Dias úteis no mês"
+GRID_DIAS_PASSADOS = np.arange(0, 32)  # slider "Dias úteis já passados"
+
+def projetar(liq, meta, dias_total, dias_passados) -> tuple:
+    """(projeção do fim do mês, tendência %, necessidade/dia) pela média diária do líquido.
+
+    Aceita escalares ou arrays que fazem broadcast (é o mesmo cálculo dos cards e da grade).
+    """
+    liq = np.asarray(liq, dtype=float); meta = np.asarray(meta, dtype=float)
+    dias_passados = np.asarray(dias_passados)
+    restantes = np.maximum(np.asarray(dias_total) - dias_passados, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        projecao = liq + np.where(dias_passados > 0, liq / dias_passados, 0.0) * restantes
+        tendencia = np.where(meta != 0, projecao / meta, 0.0) * 100
+        necessidade = np.where(restantes > 0, np.maximum(meta - liq, 0) / restantes, 0.0)
+    return projecao, tendencia, necessidade
+
+@dataclass(frozen=True)
+class ProjectionGrid:
+    """projetar() de n linhas em toda a grade: arrays (n, 31, 32) em [i, dias_total - 1, dias_passados]."""
+    projecao: np.ndarray
+    tendencia: np.ndarray
+    necessidade: np.ndarray
+
+    def at(self, dias_total: int, dias_passados: int) -> tuple:
+        """(projeção, tendência, necessidade) das n linhas num ponto dos sliders: só indexação."""
+        i, j = dias_total - 1, dias_passados
+        return self.projecao[:, i, j], self.tendencia[:, i, j], self.necessidade[:, i, j]
+
+def projection_grid(liq, meta) -> ProjectionGrid:
+    """Grade what-if (dias_total 1–31 × dias_passados 0–31) num só broadcast do NumPy."""
+    liq = np.asarray(liq, dtype=float).reshape(-1, 1, 1)
+    meta = np.asarray(meta, dtype=float).reshape(-1, 1, 1)
+    return ProjectionGrid(*projetar(liq, meta, GRID_DIAS_TOTAL[:, None], GRID_DIAS_PASSADOS[None, :]))
+
+def sensitivity_frame(grid: ProjectionGrid, linha: int, dias_total: int, vizinhos: int = 2) -> pd.DataFrame:
+    """Tendência (%) da linha por dias úteis passados, para dias_total ± `vizinhos` (gráfico de sensibilidade)."""
+    totais = range(max(1, dias_total - vizinhos), min(int(GRID_DIAS_TOTAL[-1]), dias_total + vizinhos) + 1)
+    partes = [pd.DataFrame({"dias_total": dt, "dias_passados": np.arange(1, dt + 1),
+                            "tendencia": grid.tendencia[linha, dt - 1, 1:dt + 1]}) for dt in totais]
+    return pd.concat(partes, ignore_index=True)
+
+CARD_META = {"marca": ("Meta do Dia", "Meta da Marca"), "geral": ("Meta do Dia (Geral)", "Meta Geral")}
+
+def cards_consolidado(total: int, rev: int, meta_mes: int, *, diario: bool, dias_total: int,
+                      dias_passados: int, escopo: str = "marca", proj=None) -> list:
+    """Cards (título, valor) do consolidado da marca ou geral; `diario` = dia escolhido na sidebar.
+
+    `proj` = (projeção, tendência, necessidade) já lidos da grade (ProjectionGrid.at); sem ela, calcula.
+    """
+    liq = total - rev
+    dias_restantes = max(dias_total - dias_passados, 0)
+    rot_dia, rot_mes = CARD_META[escopo]
+    if diario:
+        meta_dia = safe_div(meta_mes, dias_total)
+        faltante = max(int(round(meta_dia)) - liq, 0)
+        tendencia = safe_div(liq, meta_dia) * 100
+        return [
+            (rot_dia, int(round(meta_dia))),
+            ("Total Geral (Dia)", total),
+            ("Total Revistorias (Dia)", rev),
+            ("Total Líquido (Dia)", liq),
+            ("Faltante (Dia)", faltante),
+            ("Necessidade/dia (Dia)", faltante),
+            ("Projeção (Dia)", liq),
+            ("Tendência (Dia)", fmt_tendencia(tendencia)),
+        ]
+    faltante = max(meta_mes - liq, 0)
+    proj = proj if proj is not None else projetar(liq, meta_mes, dias_total, dias_passados)
+    projecao, tendencia, necessidade = map(float, proj)
+    necessidade = 0 if dias_restantes == 0 else int(necessidade)
+    return [
+        (rot_mes, meta_mes),
+        ("Total Geral", total),
+        ("Total Revistorias", rev),
+        ("Total Líquido", liq),
+        ("Faltante", faltante),
+        ("Necessidade/dia", necessidade),
+        ("Projeção (Fim do mês)", int(projecao)),
+        ("Tendência", fmt_tendencia(tendencia)),
+    ]
+
+def calc_ticket(q152, q190):
+    q152 = np.asarray(q152, dtype=float); q190 = np.asarray(q190, dtype=float)
+    denom = q152 + q190
+    return np.where(denom > 0, (q152*152.0 + q190*190.0) / np.where(denom > 0, denom, 1), np.nan)
+
+def unit_table(agr: pd.DataFrame, metas_agr: pd.DataFrame, *, diario: bool, dias_passados: int,
+               dias_restantes: int, proj=None) -> tuple[pd.DataFrame, str]:
+    """Indicadores por unidade a partir das somas do recorte; devolve (tabela, rótulo do líquido).
+
+    `proj` = recorte da grade das unidades (sobre o líquido MTD no modo diário); sem ela, calcula.
+    """
+    meta_mes_u = metas_agr["meta_mes"].to_numpy()
+    du_u = metas_agr["du"].to_numpy()
+    mes_encerrado = (dias_restantes == 0)
+
+    total_u = agr["total"].astype(int).to_numpy()
+    rev_u = agr["rev"].astype(int).to_numpy()
+    liq_u = total_u - rev_u
+
+    if diario:
+        meta_dia_u = np.where(du_u > 0, meta_mes_u / np.where(du_u > 0, du_u, 1), 0.0)
+        meta_col = np.round(meta_dia_u).astype(int)
+        faltante_u = np.maximum(meta_col - liq_u, 0)
+        tendencia_u = np.where(meta_dia_u != 0, liq_u / np.where(meta_dia_u != 0, meta_dia_u, 1) * 100, 0)
+        meta_label = "Meta do Dia"; falt_label = "Faltante (Dia)"
+        nec_dia_u = faltante_u
+        total_label = "Total (Dia)"; rev_label = "Revistorias (Dia)"; liq_label = "Total Líquido (Dia)"; tend_label = "Tendência (Dia)"
+        if proj is None:  # MTD até o dia escolhido (para projeção)
+            proj = projetar(agr["liq_mtd"].to_numpy(), meta_mes_u, dias_passados + dias_restantes, dias_passados)
+        proj_col = np.round(proj[0]).astype(int)
+    else:
+        meta_col = meta_mes_u
+        faltante_u = np.maximum(meta_mes_u - liq_u, 0)
+        if proj is None:
+            proj = projetar(liq_u, meta_mes_u, dias_passados + dias_restantes, dias_passados)
+        proj_final_u, tendencia_u, nec_u = proj
+        meta_label = "Meta"; falt_label = "Faltante (sobre Líquido)"
+        nec_dia_u = 0 if mes_encerrado else round_list(nec_u)
+        total_label = "Total"; rev_label = "Revistorias"; liq_label = "Total Líquido"; tend_label = "Tendência"
+        proj_col = np.round(proj_final_u).astype(int)
+
+    # ticket médio ponderado pelo mix 152/190
+    ticket_u = pd.Series(calc_ticket(agr["qtd152"], agr["qtd190"]), index=agr.index)
+    ticket_txt = ticket_u.map(lambda v: "—" if np.isnan(v) else f"R$ {v:.2f} " + ("✅" if v >= 161.50 else "❌"))
+    pct190_txt = agr["pct190"].astype(float).map(lambda p: f"{p:.0f}% " + ("✅" if p >= 25 else ("⚠️" if p >= 20 else "❌")))
+
+    tabela = pd.DataFrame({
+        "Unidade": agr["unidade"],
+        meta_label: np.asarray(meta_col).astype(int),
+        total_label: total_u, rev_label: rev_u, liq_label: liq_u,
+        falt_label: faltante_u.astype(int),
+        "Necessidade/dia": nec_dia_u,
+        tend_label: pd.Series(tendencia_u, index=agr.index).map(fmt_tendencia),
+        "Projeção (Mês)": proj_col,
+        "Ticket Médio (R$)": ticket_txt,
+        "% ≥ R$190": pct190_txt,
+    })
+
+    # --- Normalização de chaves para evitar KeyError no gráfico ---
+    for k_dia, k_mes in [("Total Líquido (Dia)", "Total Líquido"), ("Total (Dia)", "Total"), ("Revistorias (Dia)", "Revistorias")]:
+        if k_dia in tabela and k_mes not in tabela:
+            tabela[k_mes] = tabela[k_dia]
+        elif k_mes in tabela and k_dia not in tabela:
+            tabela[k_dia] = tabela[k_mes]
+    return tabela, liq_label
+
+# --- Calendário (heatmap) ---
+HEAT_DOW = ["Seg","Ter","Qua","Qui","Sex","Sáb","Dom"]
+HEAT_PCT = "% da meta do dia"
+
+def metas_dia_periodo(goals: pd.DataFrame, empresa: str, unidade: str, inicio, fim, dias_total: int) -> dict:
+    """Meta do dia de cada mês do período (meta do mês / dias úteis de referência), por AAAAMM."""
+    metas_dia = {}
+    for p in pd.period_range(inicio, fim, freq="M"):
+        ym = f"{p.year}-{p.month:02d}"
+        meta = (meta_marca_mes(goals, empresa, ym) if unidade == CONSOLIDADO
+                else meta_unidade_mes(goals, empresa, unidade, ym))
+        metas_dia[p.year * 100 + p.month] = (meta / dias_total) if dias_total else 0
+    return metas_dia
+
+def daily_liq(cube_src: pd.DataFrame, unidade: str, inicio, fim) -> pd.Series:
+    """Líquido por dia da marca (ou de uma unidade) no período."""
+    if unidade != CONSOLIDADO:
+        cube_src = cube_src[cube_src["unidade"] == unidade]
+    cube_periodo = rows_periodo(cube_src, inicio, fim)
+    return cube_sum(cube_periodo, "__data__").set_index("__data__")["liq"].astype(int)
+
+def calendar_frame(daily_liq: pd.Series, inicio: pd.Timestamp, fim: pd.Timestamp, metas_dia: dict,
+                   metric: str, show_values: bool) -> pd.DataFrame:
+    """Uma linha por dia de [inicio, fim], montada de uma vez a partir do líquido diário.
+
+    `metas_dia` mapeia ym (int AAAAMM) -> meta do dia; `week_index` conta semanas (seg–dom)
+    desde a semana de `inicio`, então serve tanto para um mês quanto para o ano.
+    """
+    dias = pd.date_range(inicio, fim, freq="D")
+    liq = daily_liq.reindex(dias).to_numpy(dtype=float)
+    ym = dias.year * 100 + dias.month
+    meta = pd.Series(ym).map(metas_dia).fillna(0).to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.where(meta > 0, liq / meta * 100, np.nan)
+    dow = dias.weekday.to_numpy()
+    semana0 = inicio - pd.Timedelta(days=inicio.weekday())
+    if metric == HEAT_PCT:
+        value = np.where(dow < 5, pct, np.nan)
+        sufixo = "%"
+    else:
+        value = liq
+        sufixo = ""
+    tem = ~np.isnan(value)
+    labels = np.full(len(dias), "", dtype=object)
+    if show_values and tem.any():
+        labels[tem] = pd.Series(np.rint(value[tem]).astype(int)).astype(str).add(sufixo).to_numpy()
+    return pd.DataFrame({
+        "date": dias, "day": dias.day, "dow_label": np.asarray(HEAT_DOW, dtype=object)[dow],
+        "week_index": ((dias - semana0).days // 7).to_numpy(), "ym": ym,
+        "liq": liq, "pct": pct, "value": value, "val_label_str": labels,
+    })
+
+# --- Catch-up e ranking ---
+CATCHUP_COLS = ["Data", "Meta (constante)", "Meta Ajustada (catch-up)", "Realizado Líquido",
+                "Δ do Dia (Real − Meta Aj.)", "Acumulado Líquido", "Saldo p/ Bater Meta", "Status"]
+
+def metas_escopo(goals: pd.DataFrame, empresa: str, ym: str, unidades, dias_total: int) -> dict:
+    """escopo (consolidado ou unidade) -> (meta do mês, dias úteis de referência)."""
+    out = {CONSOLIDADO: (meta_marca_mes(goals, empresa, ym), dias_total)}
+    metas_mes_unis = metas_unidades_df(goals, empresa, ym, unidades)
+    out.update({u: (int(m), int(du)) for u, m, du in metas_mes_unis[["unidade","meta_mes","du"]].itertuples(index=False)})
+    return out
+
+def catchup_frame(cube_month: pd.DataFrame, year: int, month: int, metas_escopo: dict) -> pd.DataFrame:
+    """Catch-up do mês para o consolidado e todas as unidades da marca de uma vez (coluna `escopo`).
+
+    `metas_escopo` mapeia escopo -> (meta do mês, dias úteis de referência).
+    """
+    cons = cube_sum(cube_month, "__data__").assign(escopo=CONSOLIDADO)
+    unis = cube_month.dropna(subset=["unidade"]).rename(columns={"unidade": "escopo"})
+    d = pd.concat([cons[["escopo","__data__","liq"]], unis[["escopo","__data__","liq"]]], ignore_index=True)
+    d = d.sort_values(["escopo","__data__"], kind="stable").reset_index(drop=True)
+    d["liq"] = d["liq"].astype(int)
+
+    # dias úteis restantes (inclusive) para cada data útil do mês; fim de semana -> 0
+    all_days = pd.date_range(pd.Timestamp(year, month, 1), periods=calendar.monthrange(year, month)[1], freq="D")
+    workdays = all_days[all_days.weekday < 5]
+    remaining = np.where(d["__data__"].dt.weekday < 5, len(workdays) - workdays.searchsorted(d["__data__"]), 0)
+
+    meta_mes = d["escopo"].map({e: m for e, (m, du) in metas_escopo.items()}).astype(float).to_numpy()
+    du_ref = d["escopo"].map({e: du for e, (m, du) in metas_escopo.items()}).astype(float).to_numpy()
+    meta_const = np.where(du_ref > 0, meta_mes / np.where(du_ref > 0, du_ref, 1), 0.0)
+
+    acum = d.groupby("escopo")["liq"].cumsum().to_numpy()
+    liq = d["liq"].to_numpy()
+    meta_aj = np.where(remaining > 0, (meta_mes - (acum - liq)) / np.where(remaining > 0, remaining, 1), 0.0)
+
+    d["Data"] = d["__data__"].dt.strftime("%d/%m/%Y")
+    d["Meta (constante)"] = round_list(meta_const)
+    d["Meta Ajustada (catch-up)"] = round_list(meta_aj)
+    d["Realizado Líquido"] = liq
+    d["Δ do Dia (Real − Meta Aj.)"] = round_list(liq - meta_aj)
+    d["Acumulado Líquido"] = acum
+    d["Saldo p/ Bater Meta"] = (meta_mes - acum).astype(int)
+    d["Status"] = np.select([(liq >= meta_aj) & (meta_aj > 0), meta_aj == 0], ["✅", "—"], "❌")
+    return d
+
+def ranking_frame(unit_daily: pd.DataFrame, goals: pd.DataFrame, empresa: str, rank_date: pd.Timestamp,
+                  ym: str) -> pd.DataFrame:
+    """Unidades da marca no dia: líquido, meta do dia, % de hoje/ontem, já ordenadas."""
+    d = unit_daily[(unit_daily["empresa"] == empresa) & (unit_daily["__data__"] == rank_date)]
+    df_rank = d.merge(metas_unidades_df(goals, empresa, ym, d["unidade"]), on="unidade", how="left")
+    df_rank["meta_dia"] = np.where(df_rank["du"]>0, df_rank["meta_mes"]/df_rank["du"], 0)
+
+    df_rank["pct_hoje"] = np.where(df_rank["meta_dia"]>0, (df_rank["liq"]/df_rank["meta_dia"])*100, 0.0)
+    df_rank["pct_ontem"] = np.where((df_rank["meta_dia"]>0) & df_rank["__data_prev__"].notna(),
+                                    (df_rank["liq_prev"]/df_rank["meta_dia"])*100, np.nan)
+    df_rank["delta_pct"] = df_rank["pct_hoje"] - df_rank["pct_ontem"]
+
+    order_col = "pct_hoje" if is_workday(rank_date) else "liq"
+    return df_rank.sort_values(order_col, ascending=False)
+
+# --- Tendência mensal (YoY / MoM) sobre o rollup ---
+def trend_series(rollup: pd.DataFrame, goals: pd.DataFrame, empresa: str, unidade: str = CONSOLIDADO) -> pd.DataFrame:
+    """Métricas por mês (índice AAAAMM) da marca consolidada ou de uma unidade."""
+    r = rollup[rollup["empresa"] == empresa]
+    if unidade != CONSOLIDADO:
+        return r[r["unidade"] == unidade].set_index("ym").sort_index()
+    s = r.groupby("ym")[ROLLUP_SUMS].sum()
+    s["meta_mes"] = [meta_marca_mes(goals, empresa, t) for t in _ym_tokens(s.index.to_numpy())]
+    return _rollup_metricas(s)
+
+def trend_table(serie: pd.Series, pontos: bool = False) -> pd.DataFrame:
+    """Valor do mês, variação contra o mês anterior (MoM) e contra o mesmo mês do ano anterior (YoY).
+
+    Variações em % do valor base; com `pontos`, em pontos percentuais (métricas que já são %).
+    """
+    yms = serie.index.to_numpy()
+    mes_ant = np.where(yms % 100 == 1, yms - 89, yms - 1)  # jan -> dez do ano anterior
+    v = serie.to_numpy(dtype=float)
+    base_mom = serie.reindex(mes_ant).to_numpy(dtype=float)
+    base_yoy = serie.reindex(yms - 100).to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if pontos:
+            mom, yoy = v - base_mom, v - base_yoy
+        else:
+            mom = np.where(base_mom > 0, (v / base_mom - 1) * 100, np.nan)
+            yoy = np.where(base_yoy > 0, (v / base_yoy - 1) * 100, np.nan)
+    return pd.DataFrame({"ym": yms, "valor": v, "mom": mom, "yoy": yoy})
+
+# =================== CLI ===================
+def _load_secrets(path) -> dict:
+    import tomllib
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+def _source_from_args(args, secrets: dict):
+    from sources import FileSheetsSource, GoogleSheetsSource, LocalSheetsSource
+    if args.local:
+        return LocalSheetsSource(args.local)
+    if args.arquivos:
+        return FileSheetsSource(args.arquivos)
+    client = None
+    def client_factory():
+        nonlocal client
+        if client is None:
+            client = authorize(secrets["gcp_service_account"])
+        return client
+    return GoogleSheetsSource(client_factory, retry_base=float(secrets.get("RETRY_BASE", 0.8)),
+                              quota_per_min=float(secrets.get("SHEETS_QUOTA_PER_MIN", 60)),
+                              quota_cooldown=float(secrets.get("QUOTA_COOLDOWN", 10)))
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--saida", required=True, help="arquivo do snapshot (SNAPSHOT_FILE do app)")
+    ap.add_argument("--local", metavar="DIR", help="usa a fonte local (CSVs) em vez do Google Sheets")
+    ap.add_argument("--arquivos", metavar="DIR", help="lê .xlsx/.csv/Parquet exportados (caminhos relativos a DIR)")
+    ap.add_argument("--secrets", default=".streamlit/secrets.toml", help="credenciais e INDEX_SHEET_ID")
+    ap.add_argument("--indice", help="ID da planilha-índice (padrão: secrets ou o do app)")
+    ap.add_argument("--cache-dir", help="cache em disco dos meses (Parquet), o mesmo CACHE_DIR do app")
+    ap.add_argument("--workers", type=int, default=None, help="leituras de planilha em paralelo")
+    ap.add_argument("--parcial", action="store_true", help="grava mesmo se alguma planilha falhar")
+    args = ap.parse_args(argv)
+
+    offline = args.local or args.arquivos
+    try:
+        secrets = _load_secrets(args.secrets) if not offline or os.path.exists(args.secrets) else {}
+    except (OSError, ValueError) as e:  # ValueError: tomllib.TOMLDecodeError
+        print(f"erro: não foi possível ler os secrets ({args.secrets}): {e}", file=sys.stderr)
+        return 1
+    index_id = args.indice or str(secrets.get("INDEX_SHEET_ID", INDEX_SHEET_ID))
+    workers = max(1, args.workers or int(secrets.get("SHEETS_MAX_WORKERS", 4)))
+
+    t0 = time.perf_counter()
+    try:  # o snapshot que já está em --saida empresta os meses fechados do rollup
+        anterior = load_snapshot(args.saida)
+    except Exception:
+        anterior = None
+    try:
+        snap = build_snapshot(_source_from_args(args, secrets), index_id,
+                              cache_dir=args.cache_dir, max_workers=workers, anterior=anterior)
+    except IngestError as e:
+        print(f"erro: {e}", file=sys.stderr)
+        return 1
+    for mes, err in snap.falhas:
+        print(f"aviso: mês {mes} ignorado: {err}", file=sys.stderr)
+    if snap.falhas and not args.parcial:
+        print("snapshot parcial não gravado (use --parcial para gravar assim mesmo)", file=sys.stderr)
+        return 2
+    save_snapshot(snap, args.saida)
+
+    visoes = sum(len(p.por_mes) + len(p.por_dia) for p in snap.brands.values())
+    print(f"{len(snap.df_full)} linhas · {len(snap.brands)} marcas · {len(snap.yms)} meses · "
+          f"{visoes} recortes marca×período → {args.saida} ({time.perf_counter() - t0:.2f}s)")
+    return 0
+
+if __name__ == "__main__":
+    # pelo módulo importado: o pickle precisa das classes como engine.DataSnapshot, não __main__.*
+    import engine
+    sys.exit(engine.main())
@@ -0,0 +1,124 @@
+# perf.py — instrumentação: tempo por seção do app, chamadas à API, retries e cache
+import json, logging, os, sys, threading, time
+from contextlib import contextmanager
+
+log = logging.getLogger("vistorias.perf")
+_log_lock = threading.Lock()
+
+def enable_log(destino: str):
+    """Liga a linha JSON de cada rerun (RunTimer.finish), que sem handler o logging descarta.
+
+    `destino` = "stderr" (ou "1"/"true") ou o caminho de um arquivo; idempotente, já que o
+    app reexecuta a cada rerun.
+    """
+    with _log_lock:
+        if getattr(log, "_vistorias_destino", None) == destino:
+            return
+        for h in list(log.handlers):
+            log.removeHandler(h)
+            h.close()
+        h = (logging.StreamHandler(sys.stderr) if destino.lower() in {"stderr", "1", "true", "sim"}
+             else logging.FileHandler(destino, encoding="utf-8"))
+        h.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(h)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+        log._vistorias_destino = destino
+
+class Metrics:
+    """Contadores e tempos acumulados do processo (compartilhados entre sessões, thread-safe)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timings = {}  # nome -> [n, soma_seg, max_seg]
+
+    def inc(self, nome: str, n: int = 1):
+        with self._lock:
+            self.counters[nome] = self.counters.get(nome, 0) + n
+
+    def observe(self, nome: str, seg: float):
+        with self._lock:
+            t = self.timings.setdefault(nome, [0, 0.0, 0.0])
+            t[0] += 1; t[1] += seg; t[2] = max(t[2], seg)
+
+    @contextmanager
+    def timed(self, nome: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(nome, time.perf_counter() - t0)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters), {k: list(v) for k, v in self.timings.items()}
+
+    def prometheus_text(self, prefix: str = "vistorias") -> str:
+        """Exposição no formato texto do Prometheus."""
+        counters, timings = self.snapshot()
+        linhas = []
+        for nome in sorted(counters):
+            linhas += [f"# TYPE {prefix}_{nome}_total counter", f"{prefix}_{nome}_total {counters[nome]}"]
+        if timings:
+            linhas.append(f"# TYPE {prefix}_section_seconds summary")
+            for nome in sorted(timings):
+                n, soma, _ = timings[nome]
+                linhas.append(f'{prefix}_section_seconds_sum{{section="{nome}"}} {soma:.6f}')
+                linhas.append(f'{prefix}_section_seconds_count{{section="{nome}"}} {n}')
+            linhas.append(f"# TYPE {prefix}_section_seconds_max gauge")
+            for nome in sorted(timings):
+                linhas.append(f'{prefix}_section_seconds_max{{section="{nome}"}} {timings[nome][2]:.6f}')
+        return "\n".join(linhas) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Grava o texto do Prometheus em `path` (troca atômica, p/ node_exporter textfile)."""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+METRICS = Metrics()
+
+class RunTimer:
+    """Cronômetro de um rerun: `lap(nome)` fecha a seção que vai do lap anterior até agora."""
+
+    def __init__(self, metrics: Metrics = METRICS):
+        self.metrics = metrics
+        self.t0 = self._last = time.perf_counter()
+        self.laps = []
+
+    def lap(self, nome: str):
+        agora = time.perf_counter()
+        seg = agora - self._last
+        self._last = agora
+        self.laps.append((nome, seg))
+        self.metrics.observe(nome, seg)
+
+    @contextmanager
+    def section(self, nome: str):
+        """Cronometra só o bloco (ex.: corpo de um st.fragment, que também roda sozinho)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            agora = time.perf_counter()
+            self._last = agora
+            self.laps.append((nome, agora - t0))
+            self.metrics.observe(nome, agora - t0)
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def finish(self, **extra):
+        """Registra o rerun no log estruturado (uma linha JSON)."""
+        self.metrics.observe("rerun", self.total)
+        log.info(json.dumps({"event": "rerun", "total_s": round(self.total, 4),
+                             "sections": {n: round(s, 4) for n, s in self.laps}, **extra},
+                            ensure_ascii=False))
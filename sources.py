@@ -0,0 +1,432 @@
+# sources.py — fontes de dados das planilhas (Google Sheets ou arquivos locais) + retry
+import csv, random, threading, time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from gspread.utils import numericise_all, rowcol_to_a1
+from requests import exceptions as req_exc
+
+from perf import METRICS
+
+# =================== RETRY ===================
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+QUOTA_STATUS = 429
+
+def error_status(exc: Exception) -> int | None:
+    """Status HTTP do erro: `code` do APIError do gspread / LocalSourceError, ou o da resposta."""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int) and code > 0:
+        return code
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+def should_retry(exc: Exception) -> bool:
+    """Retry só para status transitórios (429/5xx/408) ou falha de rede sem resposta."""
+    status = error_status(exc)
+    if status is not None:
+        return status in RETRY_STATUS
+    return isinstance(exc, (ConnectionError, TimeoutError, req_exc.ConnectionError, req_exc.Timeout))
+
+class TokenBucket:
+    """Limite de chamadas do processo (todas as sessões e threads): `per_minute`, com rajada de até
+    `burst` chamadas. `per_minute` <= 0 desliga o limite."""
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.rate = float(per_minute) / 60.0
+        self.capacity = float(burst if burst is not None else per_minute)
+        self.tokens = self.capacity
+        self._t = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (agora - self._t) * self.rate)
+                self._t = agora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.rate
+            METRICS.inc("sheets_throttled")
+            time.sleep(espera)
+
+class CircuitBreaker:
+    """Pausa compartilhada quando a cota estoura: um 429 abre o circuito por `cooldown` s (dobrando
+    a cada estouro seguido, até `max_cooldown`) e todo chamador espera antes da próxima chamada."""
+
+    def __init__(self, cooldown: float = 10.0, max_cooldown: float = 60.0):
+        self.cooldown, self.max_cooldown = float(cooldown), float(max_cooldown)
+        self.open_until = 0.0
+        self.strikes = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            espera = self.open_until - time.monotonic()
+        if espera > 0:
+            METRICS.inc("sheets_breaker_waits")
+            time.sleep(espera)
+
+    def trip(self):
+        with self._lock:
+            agora = time.monotonic()
+            if agora < self.open_until:
+                return  # 429 da mesma rajada: o circuito já está aberto
+            self.strikes += 1
+            self.trips += 1
+            self.open_until = agora + min(self.cooldown * 2 ** (self.strikes - 1), self.max_cooldown)
+        METRICS.inc("sheets_breaker_trips")
+
+    def success(self):
+        if self.strikes:
+            with self._lock:
+                self.strikes = 0
+
+def with_retry(fn, *, tries=5, base=0.8, jitter=0.3, limiter=None, breaker=None):
+    """Chama `fn` respeitando o limitador e o circuito compartilhados.
+
+    429 abre o circuito (a espera é a mesma para todos); 5xx/rede usam backoff exponencial local.
+    """
+    last = None
+    for i in range(tries):
+        if breaker is not None:
+            breaker.wait()
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            METRICS.inc("sheets_api_calls")
+            out = fn()
+            if breaker is not None:
+                breaker.success()
+            return out
+        except Exception as e:
+            last = e
+            if i == tries - 1 or not should_retry(e):
+                METRICS.inc("sheets_api_errors")
+                raise
+            METRICS.inc("sheets_retries")
+            if error_status(e) == QUOTA_STATUS and breaker is not None:
+                breaker.trip()
+                continue
+            time.sleep(base * (2 ** i) + random.random() * jitter)
+    if last:
+        raise last
+
+# =================== MATRIZ DE VALORES → REGISTROS / COLUNAS ===================
+def _pad(rows, n):
+    return [list(r) + [""] * (n - len(r)) for r in rows]
+
+def values_to_records(values):
+    """Matriz crua (1ª linha = cabeçalho) → registros, como o get_all_records do gspread."""
+    if not values or not values[0]:
+        return []
+    head = values[0]
+    return [dict(zip(head, numericise_all(r))) for r in _pad(values[1:], len(head))]
+
+def pick_columns(head, cols, names):
+    """{nome: valores} das `names` presentes no cabeçalho, numericised e com o mesmo tamanho.
+
+    `cols[i]` são os valores (sem cabeçalho) da coluna `head[i]`; a 1ª ocorrência de um nome vale.
+    """
+    pos = {}
+    for i, h in enumerate(head):
+        pos.setdefault(str(h).strip(), i)
+    out = {n: cols[pos[n]] for n in names if n in pos}
+    n = max((len(v) for v in out.values()), default=0)
+    return {k: numericise_all(list(v) + [""] * (n - len(v))) for k, v in out.items()}
+
+def _header_row(row) -> tuple:
+    """Linha de cabeçalho normalizada (sem espaços nas pontas nem células vazias no fim)."""
+    head = [str(h).strip() for h in row]
+    while head and not head[-1]:
+        head.pop()
+    return tuple(head)
+
+# =================== GOOGLE SHEETS ===================
+class GoogleSheetsSource:
+    """Lê as planilhas pela API (gspread). `client_factory` devolve o client autorizado."""
+
+    def __init__(self, client_factory, *, retry_base=0.8, quota_per_min=60, quota_cooldown=10.0):
+        self.client_factory = client_factory
+        self.retry_base = retry_base
+        self.limiter = TokenBucket(quota_per_min)   # cota de leitura do Sheets por minuto
+        self.breaker = CircuitBreaker(quota_cooldown)
+        self._layout = {}  # sheet_key -> cabeçalho (linha 1) da última leitura
+
+    def _retry(self, fn):
+        return with_retry(fn, base=self.retry_base, limiter=self.limiter, breaker=self.breaker)
+
+    def records(self, sheet_key: str, tab: str | None):
+        """Registros da worksheet (`tab` ou sheet1) como lista de dicts."""
+        client = self.client_factory()
+        sh = self._retry(lambda: client.open_by_key(sheet_key))
+        ws = self._retry(lambda: (sh.worksheet(tab) if tab else sh.sheet1))
+        return self._retry(lambda: ws.get_all_records())
+
+    def _batch_get(self, sheet_key: str, ranges, major="ROWS"):
+        """Um único values:batchGet (sem abrir a planilha); devolve a matriz de cada range."""
+        client = self.client_factory()
+        resp = self._retry(lambda: client.http_client.values_batch_get(
+            sheet_key, list(ranges), params={"majorDimension": major}))
+        return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+    def batch_records(self, sheet_key: str, tabs):
+        """Registros de várias abas numa só chamada (ex.: ARQUIVOS + METAS do índice)."""
+        return [values_to_records(v) for v in self._batch_get(sheet_key, [f"'{t}'" for t in tabs])]
+
+    def columns(self, sheet_key: str, names, start_row: int = 2):
+        """Só as colunas `names` da 1ª aba, por coluna ({nome: valores}), a partir de `start_row`.
+
+        Guarda o cabeçalho inteiro por planilha: na leitura seguinte pede a linha 1 junto com as
+        colunas e, se ela mudou (coluna nova, removida ou movida), remapeia e pede de novo.
+        """
+        head = self._layout.get(sheet_key)
+        for _ in range(3):  # 1ª leitura da planilha: só a linha 1, depois as colunas
+            pos = {}
+            for i, h in enumerate(head or ()):
+                pos.setdefault(h, rowcol_to_a1(1, i + 1)[:-1])
+            letras = {n: pos[n] for n in names if n in pos}
+            ranges = ["1:1"] + [f"{c}{max(start_row, 2)}:{c}" for c in letras.values()]
+            resp = self._batch_get(sheet_key, ranges, major="COLUMNS")
+            atual = _header_row([c[0] if c else "" for c in resp[0]] if resp else [])
+            if atual == head:
+                cols = [c[0] if c else [] for c in resp[1:]]
+                return pick_columns(list(letras), cols, names) if letras else {}
+            head = self._layout[sheet_key] = atual  # cabeçalho novo ou mudou: remapeia
+        raise RuntimeError(f"Cabeçalho instável na planilha {sheet_key}")
+
+    def revision(self, sheet_key: str) -> str | None:
+        """modifiedTime no Drive (None se a Drive API falhar)."""
+        client = self.client_factory()
+        try:  # cota do Drive é outra: fora do limitador do Sheets
+            meta = with_retry(lambda: client.get_file_drive_metadata(sheet_key), base=self.retry_base)
+        except Exception:
+            return None
+        return meta.get("modifiedTime")
+
+# =================== STAND-IN LOCAL (fixtures) ===================
+class LocalSourceError(Exception):
+    """Erro simulado da API; `code` é o status HTTP (classificado como o do APIError do gspread)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"APIError: [{code}]: {message}")
+        self.code = code
+
+class LocalSheetsSource:
+    """Serve ARQUIVOS, METAS e planilhas de mês a partir de CSVs em disco.
+
+    Layout: `<root>/<sheet_key>/<tab>.csv`; sem aba, lê `sheet1.csv`. Cada chamada simula a
+    API: espera `latency` (+ `jitter`) segundos e pode falhar com 429 (`rate_limit_prob`) ou
+    500 (`error_prob`). Os valores passam por numericise, como no get_all_records do gspread.
+    """
+
+    def __init__(self, root, *, latency=0.0, jitter=0.0, rate_limit_prob=0.0, error_prob=0.0,
+                 seed=None, retry_base=0.8, quota_per_min=0, quota_cooldown=1.0):
+        self.root = Path(root)
+        self.latency, self.jitter = float(latency), float(jitter)
+        self.rate_limit_prob, self.error_prob = float(rate_limit_prob), float(error_prob)
+        self.retry_base = retry_base
+        self.limiter = TokenBucket(quota_per_min)
+        self.breaker = CircuitBreaker(quota_cooldown)
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            sorteio = self._rnd.random()
+            espera = self.latency + self._rnd.random() * self.jitter
+        if espera:
+            time.sleep(espera)
+        if sorteio < self.rate_limit_prob:
+            with self._lock:
+                self.failures += 1
+            raise LocalSourceError(429, "Quota exceeded for quota metric 'Read requests' (rate limit)")
+        if sorteio < self.rate_limit_prob + self.error_prob:
+            with self._lock:
+                self.failures += 1
+            raise LocalSourceError(500, "Internal error encountered (backend error)")
+
+    def _retry(self, fn):
+        return with_retry(fn, base=self.retry_base, limiter=self.limiter, breaker=self.breaker)
+
+    def _path(self, sheet_key: str, tab: str | None) -> Path:
+        return self.root / sheet_key / f"{tab or 'sheet1'}.csv"
+
+    def _read(self, sheet_key: str, tab: str | None):
+        self._call()
+        path = self._path(sheet_key, tab)
+        if not path.exists():
+            raise LocalSourceError(404, f"Requested entity was not found: {path}")
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f))
+        return rows
+
+    def records(self, sheet_key: str, tab: str | None):
+        return self._retry(lambda: values_to_records(self._read(sheet_key, tab)))
+
+    def _read_many(self, sheet_key: str, tabs):
+        """Várias abas numa única chamada simulada (como o values:batchGet)."""
+        self._call()
+        out = []
+        for tab in tabs:
+            path = self._path(sheet_key, tab)
+            if not path.exists():
+                raise LocalSourceError(400, f"Unable to parse range: '{tab}'")
+            with open(path, newline="", encoding="utf-8") as f:
+                out.append(list(csv.reader(f)))
+        return out
+
+    def batch_records(self, sheet_key: str, tabs):
+        return self._retry(lambda: [values_to_records(v) for v in self._read_many(sheet_key, tabs)])
+
+    def columns(self, sheet_key: str, names, start_row: int = 2):
+        def ler():
+            rows = self._read(sheet_key, None)
+            if not rows:
+                return {}
+            head = rows[0]
+            corpo = _pad(rows[max(start_row, 2) - 1:], len(head))
+            cols = [list(c) for c in zip(*corpo)] or [[] for _ in head]
+            return pick_columns(head, cols, names)
+        return self._retry(ler)
+
+    def revision(self, sheet_key: str) -> str | None:
+        folder = self.root / sheet_key
+        if not folder.is_dir():
+            return None
+        mtime = max((p.stat().st_mtime_ns for p in folder.glob("*.csv")), default=0)
+        return datetime.fromtimestamp(mtime / 1e9, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+# =================== ARQUIVOS EXPORTADOS (.xlsx / .csv / Parquet) ===================
+FILE_EXTS = (".xlsx", ".xlsm", ".csv", ".parquet")
+
+class FileSourceError(Exception):
+    """Arquivo ou aba inexistente; `code` segue o status da API (400 = aba, 404 = arquivo)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+
+def _cell(v):
+    return "" if v is None else v
+
+def _trim(cols):
+    """Tira as linhas vazias do fim (como a API, que não devolve a cauda em branco)."""
+    n = max((len(c) for c in cols), default=0)
+    while n and all(c[n - 1] == "" for c in cols):
+        n -= 1
+    return [c[:n] for c in cols]
+
+def _wanted(head, names):
+    """Posições (1ª ocorrência) das colunas `names` no cabeçalho, na ordem do cabeçalho."""
+    pos = {}
+    for i, h in enumerate(head):
+        pos.setdefault(str(h).strip(), i)
+    return sorted({pos[n] for n in names if n in pos})
+
+class FileSheetsSource:
+    """Lê planilhas exportadas em disco, sem API (sem cota nem retry).
+
+    `sheet_key` é o caminho (relativo a `root`) de um .xlsx, .csv ou .parquet, ou de uma pasta
+    com um arquivo por aba (`<aba>.csv`/`.parquet`/`.xlsx`; sem aba, `sheet1.*`). Na aba ARQUIVOS
+    a pasta vai com barra no caminho (`exports/2026-10`, `./2026-10`). No .xlsx as abas
+    são as worksheets (sem aba, a 1ª). O .xlsx é lido em streaming (openpyxl read_only) só no
+    intervalo das colunas pedidas; o Parquet lê só as colunas pedidas.
+    """
+
+    def __init__(self, root="."):
+        self.root = Path(root)
+
+    def _resolve(self, sheet_key: str, tab: str | None):
+        """(arquivo, worksheet do .xlsx ou None)."""
+        path = self.root / sheet_key
+        if path.is_dir():
+            for ext in FILE_EXTS:
+                cand = path / f"{tab or 'sheet1'}{ext}"
+                if cand.exists():
+                    return cand, None
+            raise FileSourceError(400, f"Unable to parse range: '{tab}'")
+        if not path.exists():
+            raise FileSourceError(404, f"Requested entity was not found: {path}")
+        if path.suffix.lower() not in FILE_EXTS:
+            raise FileSourceError(400, f"Formato não suportado: {path.suffix}")
+        if tab and path.suffix.lower() in (".csv", ".parquet"):
+            raise FileSourceError(400, f"Unable to parse range: '{tab}'")
+        return path, tab
+
+    def _scan(self, sheet_key: str, tab: str | None, names=None, start_row: int = 2):
+        """(cabeçalho, colunas) a partir de `start_row`; com `names`, só essas colunas."""
+        path, ws_name = self._resolve(sheet_key, tab)
+        suf = path.suffix.lower()
+        start = max(start_row, 2)
+        METRICS.inc("file_reads")
+        if suf == ".parquet":
+            import pyarrow.parquet as pq
+            pf = pq.ParquetFile(path)
+            head = list(pf.schema_arrow.names)
+            idx = _wanted(head, names) if names is not None else list(range(len(head)))
+            t = pf.read(columns=[head[i] for i in idx]).slice(start - 2)
+            return [head[i] for i in idx], [[_cell(v) for v in c.to_pylist()] for c in t.columns]
+        if suf == ".csv":
+            with open(path, newline="", encoding="utf-8-sig") as f:  # "CSV UTF-8" do Excel traz BOM
+                rows = csv.reader(f)
+                head = next(rows, [])
+                idx = _wanted(head, names) if names is not None else list(range(len(head)))
+                cols = [[] for _ in idx]
+                for n, row in enumerate(rows, start=2):
+                    if n < start:
+                        continue
+                    for c, i in zip(cols, idx):
+                        c.append(row[i] if i < len(row) else "")
+            return [head[i] for i in idx], _trim(cols)
+
+        import openpyxl
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            try:
+                ws = wb[ws_name] if ws_name else wb.worksheets[0]
+            except KeyError:
+                raise FileSourceError(400, f"Unable to parse range: '{ws_name}'") from None
+            ws.reset_dimensions()  # exportações costumam gravar a dimensão errada ("A1")
+            head = [_cell(v) for v in next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())]
+            idx = _wanted(head, names) if names is not None else list(range(len(head)))
+            cols = [[] for _ in idx]
+            if idx:
+                lo, hi = idx[0], idx[-1]
+                for row in ws.iter_rows(min_row=start, min_col=lo + 1, max_col=hi + 1, values_only=True):
+                    for c, i in zip(cols, idx):
+                        c.append(_cell(row[i - lo]) if i - lo < len(row) else "")
+        finally:
+            wb.close()
+        return [head[i] for i in idx], _trim(cols)
+
+    def _values(self, sheet_key: str, tab: str | None):
+        """Matriz (cabeçalho + linhas) da aba, para values_to_records."""
+        head, cols = self._scan(sheet_key, tab)
+        return [head] + [list(r) for r in zip(*cols)]
+
+    def records(self, sheet_key: str, tab: str | None):
+        return values_to_records(self._values(sheet_key, tab))
+
+    def batch_records(self, sheet_key: str, tabs):
+        return [values_to_records(self._values(sheet_key, t)) for t in tabs]
+
+    def columns(self, sheet_key: str, names, start_row: int = 2):
+        head, cols = self._scan(sheet_key, None, names, start_row)
+        return pick_columns(head, cols, names) if head else {}
+
+    def revision(self, sheet_key: str) -> str | None:
+        """mtime do arquivo (ou o mais recente da pasta), no formato do modifiedTime do Drive."""
+        path = self.root / sheet_key
+        try:
+            files = [p for p in path.iterdir() if p.suffix.lower() in FILE_EXTS] if path.is_dir() else [path]
+            mtime = max((p.stat().st_mtime_ns for p in files), default=0)
+        except OSError:
+            return None
+        return datetime.fromtimestamp(mtime / 1e9, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")